@@ -16,24 +16,22 @@ class CentralWidget(QWidget):
                                'Right click to split vertically\n'
                                'Middle click to delete')
         mainLayout = QTilingLayout(pane)
+        mainLayout.layoutChanged.connect(self.update_names)
         self.setLayout(mainLayout)
 
     def hsplit(self, pane):
-        self.layout().hsplit(pane, Pane(self))
-        self.update_names()
+        self.layout().hsplit(pane, lambda pos: Pane(self))
 
     def vsplit(self, pane):
-        self.layout().vsplit(pane, Pane(self))
-        self.update_names()
+        self.layout().vsplit(pane, lambda pos: Pane(self))
 
     def delete(self, pane):
         self.layout().remove_widget(pane)
-        self.update_names()
 
-    def update_names(self):
-        for i in range(self.layout().count()):
-            pane = self.layout().itemAt(i).widget()
-            pos = self.layout().getItemPosition(i)
+    def update_names(self, diff):
+        for pane, pos in diff.added:
+            pane.layout().itemAt(0).widget().setText(str(pos))
+        for pane, _, pos in diff.moved:
             pane.layout().itemAt(0).widget().setText(str(pos))
 
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Replays a trace saved by TraceRecorder and reports where the time went.
+
+Usage: replay.py [--profile] [--geometry-layout] TRACE
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+from collections import defaultdict
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from tilinglayout import (QTilingGeometryLayout, QTilingLayout, TraceRecorder,
+                          replay_trace)
+from PyQt5.QtWidgets import QApplication, QWidget
+
+
+def print_summary(trace, replayed):
+    times = defaultdict(list)
+    for operation in replayed:
+        times[operation.name].append(operation.elapsed)
+    print('{:<22}{:>8}{:>12}{:>12}{:>12}'.format('operation', 'count',
+                                                 'total ms', 'mean ms',
+                                                 'max ms'))
+    for name, elapsed in sorted(times.items(), key=lambda item: -sum(item[1])):
+        print('{:<22}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+            name, len(elapsed), sum(elapsed) * 1000,
+            sum(elapsed) * 1000 / len(elapsed), max(elapsed) * 1000))
+    for i, (recorded, operation) in enumerate(zip(trace.operations,
+                                                  replayed)):
+        if recorded.error != operation.error:
+            print('Operation {} ({}) raised {} but {} was recorded'.format(
+                i, operation.name, operation.error, recorded.error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace', help='a file written by TraceRecorder.save')
+    parser.add_argument('--profile', action='store_true',
+                        help='run the replay under cProfile and show the '
+                             'hotspots')
+    parser.add_argument('--geometry-layout', action='store_true',
+                        help='replay on a QTilingGeometryLayout')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    trace = TraceRecorder.load(args.trace)
+    if not trace.replayable:
+        print('The layout changed in ways the trace does not reproduce, so '
+              'the replay may differ from the recording\n')
+    layout_class = (QTilingGeometryLayout if args.geometry_layout
+                    else QTilingLayout)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    _, replayed = replay_trace(trace, lambda widget_id: QWidget(),
+                               layout_class)
+    if profiler:
+        profiler.disable()
+    print_summary(trace, replayed)
+    if profiler:
+        print()
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,18 @@
 
 import sys
 import os
+import gc
 import unittest
 import random
+import time
 import types
+import tempfile
+import pickle
+import tracemalloc
+import weakref
+from concurrent.futures import Future
+from PyQt5 import sip
+from PyQt5.QtCore import QEvent, QPoint, QRect
 from PyQt5.QtWidgets import QWidget, QApplication
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
@@ -14,7 +23,16 @@ from tilinglayout import (QTilingLayout, EmptyBlock, InvalidBlockException,
                           PointOutsideGridException, WidgetOverlapException,
                           SplitLimitException, ImpossibleToBuildBlockException,
                           SplitException, NonRectangularRecBlockException,
-                          WidgetNotInLayoutException)
+                          WidgetNotInLayoutException,
+                          EmptySpaceInLayoutException, WorkspaceManager,
+                          TilingModel, LayoutDiff, NavigationIndex,
+                          QTilingGeometryLayout, InconsistentGridException,
+                          TraceRecorder, replay_trace, LayoutSnapshot)
+
+
+# Every operation performed by the tests verifies the invariants of the tiling
+QTilingLayout.check_invariants = True
+QTilingGeometryLayout.check_invariants = True
 
 
 class Widget(QWidget):
@@ -30,6 +48,22 @@ class Widget(QWidget):
         return self.__str__()
 
 
+def record_calls(obj, *names, calls=None):
+    """Wraps methods of an object to record every call made to them.
+
+    Returns the list to which a (name, args) tuple is appended on each call,
+    which is calls if given.
+    """
+    if calls is None:
+        calls = []
+    for name in names:
+        def recorder(self, *args, name=name, original=getattr(obj, name)):
+            calls.append((name, args))
+            return original(*args)
+        setattr(obj, name, types.MethodType(recorder, obj))
+    return calls
+
+
 class SplitExceptionTestCase(unittest.TestCase):
 
     #  ┌───┬───┐
@@ -87,6 +121,23 @@ class SplitExceptionTestCase(unittest.TestCase):
             '(1, 0, 1, 2)'
         )
 
+    def test_lazy_message(self):
+        state = [(Widget(i), (i, 0, 1, 2)) for i in range(100)]
+        ex = SplitException(state, state[42][0], 'hsplit')
+        self.assertEqual(ex.args, ())
+        self.assertNotIn('positions', vars(ex))
+        self.assertEqual(ex.widget_pos, (42, 0, 1, 2))
+        self.assertEqual(ex.positions, [pos for _, pos in state])
+        self.assertTrue(str(ex).startswith(
+            'Exception raised when performing a "hsplit" operation of the '
+            'widget positioned at (42, 0, 1, 2).\nPositions:\n(0, 0, 1, 2)\n'
+        ))
+
+    def test_unknown_widget(self):
+        ex = SplitException([('widget1', (0, 0, 2, 2))], 'widget2', 'remove')
+        self.assertIsNone(ex.widget_pos)
+        self.assertEqual(ex.positions, [(0, 0, 2, 2)])
+
     def test_invalid_operation(self):
         with self.assertRaises(ValueError) as cm:
             SplitException([], 0, 'split')
@@ -116,10 +167,13 @@ class SplitExceptionTestCase(unittest.TestCase):
         self.assertEqual(cm.exception.operation, 'vsplit')
 
     def test_spliterror_in_remove(self):
-        self.layout._get_item_position = types.MethodType(
+        # Removals are computed on a model of the layout
+        model = self.layout._get_model()
+        model._get_item_position = types.MethodType(
             lambda *args, **kwargs: 1/0,
-            self.layout
+            model
         )
+        self.layout._get_model = lambda: model
         with self.assertRaises(SplitException) as cm:
             self.layout.remove_widget(self.ws[0])
         self.assertEqual(cm.exception.positions, [(0, 0, 2, 1), (0, 1, 2, 1)])
@@ -170,6 +224,45 @@ class RandomSplitsTestCase(unittest.TestCase):
                                 random.choice(new_operations))
 
 
+@unittest.skipUnless('AllocationBenchmark' in sys.argv,
+                     'Only run if explicitly called')
+class AllocationBenchmark(unittest.TestCase):
+    """Reports the memory allocated by a fixed sequence of operations."""
+
+    def setUp(self):
+        self.app = QApplication([])
+        random.seed(0)
+        self.widgets = [Widget(i) for i in range(500)]
+
+    def test(self):
+        layout = QTilingLayout(max_span=24)
+        layout.check_invariants = False
+        layout.addWidget(self.widgets[0], 0, 0, 24, 24)
+        unused = self.widgets[:0:-1]
+        peaks = []
+        tracemalloc.start()
+        for _ in range(200):
+            widgets = [widget for widget, _ in layout._get_state()]
+            widget = random.choice(widgets)
+            operation = random.choice(('hsplit', 'vsplit', 'remove')
+                                      if len(widgets) > 1 else ('hsplit',))
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            if operation == 'remove':
+                layout.remove_widget(widget)
+                unused.append(widget)
+            else:
+                new_widget = unused.pop()
+                try:
+                    getattr(layout, operation)(widget, new_widget)
+                except SplitLimitException:
+                    unused.append(new_widget)
+            peaks.append(tracemalloc.get_traced_memory()[1] - start)
+        tracemalloc.stop()
+        print('\nPeak memory per operation: mean {:.1f} KiB, max {:.1f} KiB'
+              .format(sum(peaks) / len(peaks) / 1024, max(peaks) / 1024))
+
+
 class TransposedMethodsTestCase(unittest.TestCase):
 
     #  ┌───┬──────────┐
@@ -346,6 +439,515 @@ class SplitsTestCase(unittest.TestCase):
             self.layout.hsplit(self.ws[0], Widget(2))
 
 
+class FactorySplitsTestCase(unittest.TestCase):
+
+    #  ┌───────┐
+    #  │       │
+    #  │   0   │
+    #  │       │
+    #  └───────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(2)]
+        self.layout = QTilingLayout(max_span=2)
+        self.layout.addWidget(self.ws[0], 0, 0, 2, 2)
+        self.calls = []
+
+    def factory(self, pos):
+        self.calls.append(pos)
+        return Widget('new')
+
+    def test_hsplit(self):
+        new_widget = self.layout.hsplit(self.ws[0], self.factory)
+        self.assertEqual(self.calls, [(1, 0, 1, 2)])
+        self.assertEqual(self.layout._get_item_position(self.ws[0], False),
+                         (0, 0, 1, 2))
+        self.assertEqual(self.layout._get_item_position(new_widget, False),
+                         (1, 0, 1, 2))
+
+    def test_vsplit_before(self):
+        new_widget = self.layout.vsplit(self.ws[0], self.factory, True)
+        self.assertEqual(self.calls, [(0, 0, 2, 1)])
+        self.assertEqual(self.layout._get_item_position(self.ws[0], False),
+                         (0, 1, 2, 1))
+        self.assertEqual(self.layout._get_item_position(new_widget, False),
+                         (0, 0, 2, 1))
+
+    def test_split_limit(self):
+        self.layout.hsplit(self.ws[0], self.ws[1])
+        state = self.layout._get_state()
+        with self.assertRaises(SplitLimitException):
+            self.layout.hsplit(self.ws[0], self.factory)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.layout._get_state(), state)
+
+    def test_invalid_widget(self):
+        with self.assertRaises(SplitException):
+            self.layout.hsplit(Widget('other'), self.factory)
+        self.assertEqual(self.calls, [])
+
+
+class TilingModelTestCase(unittest.TestCase):
+
+    #  ┌───┬──────────┐
+    #  │   │    1     │
+    #  │ 0 ├───┬──────┤
+    #  │   │ 2 │      │
+    #  ├───┴───┤      │
+    #  │       │  3   │
+    #  │   4   │      │
+    #  │       │      │
+    #  └───────┴──────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.widgets = [Widget(i) for i in range(5)]
+        self.layout = QTilingLayout(max_span=4)
+        self.layout.addWidget(self.widgets[0], 0, 0, 2, 1)
+        self.layout.addWidget(self.widgets[1], 0, 1, 1, 3)
+        self.layout.addWidget(self.widgets[2], 1, 1, 1, 1)
+        self.layout.addWidget(self.widgets[3], 1, 2, 3, 2)
+        self.layout.addWidget(self.widgets[4], 2, 0, 2, 2)
+        self.model = TilingModel(4, self.layout._get_state())
+
+    def test_primitives(self):
+        self.assertEqual(self.model.count(), 5)
+        self.assertEqual(self.model._get_state(), self.layout._get_state())
+        for i in range(4):
+            for j in range(4):
+                self.assertIs(self.model._item_at_position(i, j,
+                                                           False).widget(),
+                              self.layout.itemAtPosition(i, j).widget())
+                self.assertIs(self.model._item_at_position(i, j,
+                                                           True).widget(),
+                              self.layout.itemAtPosition(j, i).widget())
+        self.assertEqual(self.model._get_item_position(self.widgets[3], True),
+                         (2, 1, 2, 3))
+        with self.assertRaises(PointOutsideGridException):
+            self.model._item_at_position(4, 0, False)
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.model._get_item_position(Widget('new'), False)
+        with self.assertRaises(WidgetOverlapException):
+            self.model._add_widget(Widget('new'), 1, 1, 2, 2, False)
+
+    def test_same_as_layout(self):
+        new_widget = Widget('new')
+        self.model._split_widgets(self.widgets[2], new_widget, False, True)
+        self.layout.vsplit(self.widgets[2], new_widget)
+        self.assertEqual(self.model._get_state(), self.layout._get_state())
+        self.model._remove_widget(self.widgets[0])
+        self.layout.remove_widget(self.widgets[0])
+        self.assertEqual(self.model._get_state(), self.layout._get_state())
+
+    def test_copy(self):
+        copy = self.model.copy()
+        copy.remove_widget(self.widgets[0])
+        self.assertEqual(self.model._get_state(), self.layout._get_state())
+        self.assertEqual(copy.count(), 4)
+
+    def test_operations(self):
+        new_widgets = [Widget('new') for i in range(3)]
+        self.assertIs(self.model.hsplit(self.widgets[3], new_widgets[0]),
+                      new_widgets[0])
+        self.assertIs(self.model.vsplit(self.widgets[4], new_widgets[1],
+                                        True), new_widgets[1])
+        self.model.remove_widget(self.widgets[1])
+        self.layout.hsplit(self.widgets[3], new_widgets[0])
+        self.layout.vsplit(self.widgets[4], new_widgets[1], True)
+        self.layout.remove_widget(self.widgets[1])
+        self.assertCountEqual(self.model._get_state(),
+                              self.layout._get_state())
+
+    def test_failed_operations(self):
+        model = TilingModel(1, [(self.widgets[0], (0, 0, 1, 1))])
+        with self.assertRaises(SplitLimitException):
+            model.vsplit(self.widgets[0], Widget('new'))
+        self.assertEqual(model._get_state(), [(self.widgets[0], (0, 0, 1, 1))])
+        state = self.model._get_state()
+        with self.assertRaises(SplitException) as cm:
+            self.model.remove_widget(Widget('new'))
+        self.assertIsInstance(cm.exception.__cause__,
+                              WidgetNotInLayoutException)
+        self.assertEqual(self.model._get_state(), state)
+        self.model._verify_tiling()
+
+
+class DryRunTestCase(unittest.TestCase):
+
+    #  ┌───────┐
+    #  │   0   │
+    #  ├───┬───┤
+    #  │ 1 │ 2 │
+    #  └───┴───┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(3)]
+        self.layout = QTilingLayout(max_span=2)
+        self.layout.addWidget(self.ws[0], 0, 0, 1, 2)
+        self.layout.addWidget(self.ws[1], 1, 0, 1, 1)
+        self.layout.addWidget(self.ws[2], 1, 1, 1, 1)
+        self.state = self.layout._get_state()
+        self.qt_calls = record_calls(self.layout, 'addWidget', 'removeWidget')
+
+    def tearDown(self):
+        self.assertEqual(self.qt_calls, [])
+        self.assertEqual(self.layout._get_state(), self.state)
+
+    def test_can_hsplit(self):
+        self.assertFalse(self.layout.can_hsplit(self.ws[0]))
+        self.assertFalse(self.layout.can_hsplit(self.ws[1]))
+        self.assertEqual(self.layout.can_hsplit(self.ws[2], True, True),
+                         (False, None))
+
+    def test_can_vsplit(self):
+        self.assertFalse(self.layout.can_vsplit(self.ws[1]))
+        possible, state = self.layout.can_vsplit(self.ws[0], True, True)
+        self.assertTrue(possible)
+        self.assertCountEqual(state, [(self.ws[0], (0, 1, 1, 1)),
+                                      (self.ws[1], (1, 0, 1, 1)),
+                                      (self.ws[2], (1, 1, 1, 1)),
+                                      (None, (0, 0, 1, 1))])
+
+    def test_can_remove(self):
+        self.assertTrue(self.layout.can_remove(self.ws[1]))
+        possible, state = self.layout.can_remove(self.ws[0], True)
+        self.assertTrue(possible)
+        self.assertCountEqual(state, [(self.ws[1], (0, 0, 2, 1)),
+                                      (self.ws[2], (0, 1, 2, 1))])
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.layout.can_remove(Widget('other'))
+
+
+class BatchTestCase(unittest.TestCase):
+
+    #  ┌───┬──────────┐
+    #  │   │    1     │
+    #  │ 0 ├───┬──────┤
+    #  │   │ 2 │      │
+    #  ├───┴───┤      │
+    #  │       │  3   │
+    #  │   4   │      │
+    #  │       │      │
+    #  └───────┴──────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.widgets = [Widget(i) for i in range(7)]
+        self.layouts = [QTilingLayout(max_span=4), QTilingLayout(max_span=4)]
+        for layout in self.layouts:
+            layout.addWidget(self.widgets[0], 0, 0, 2, 1)
+            layout.addWidget(self.widgets[1], 0, 1, 1, 3)
+            layout.addWidget(self.widgets[2], 1, 1, 1, 1)
+            layout.addWidget(self.widgets[3], 1, 2, 3, 2)
+            layout.addWidget(self.widgets[4], 2, 0, 2, 2)
+        self.layout = self.layouts[0]
+        self.state = self.layout._get_state()
+
+    def _operations(self, layout):
+        layout.hsplit(self.widgets[3], self.widgets[5])
+        layout.vsplit(self.widgets[4], self.widgets[6], True)
+        layout.remove_widget(self.widgets[1])
+
+    def test_same_result(self):
+        with self.layout.batch():
+            self._operations(self.layout)
+            self.assertEqual(self.layout._get_state(), self.state)
+        self._operations(self.layouts[1])
+        self.assertCountEqual(self.layout._get_state(),
+                              self.layouts[1]._get_state())
+        self.assertTrue(self.widgets[1].isHidden())
+
+    def test_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.layout.batch():
+                self._operations(self.layout)
+                1/0
+        self.assertEqual(self.layout._get_state(), self.state)
+        self.assertIsNone(self.layout._batch_model)
+
+    def test_failed_operation(self):
+        with self.layout.batch():
+            self.layout.hsplit(self.widgets[2], self.widgets[5])
+            with self.assertRaises(SplitLimitException):
+                self.layout.hsplit(self.widgets[2], self.widgets[6])
+            self.layout.vsplit(self.widgets[0], self.widgets[6])
+        self.layouts[1].hsplit(self.widgets[2], self.widgets[5])
+        self.layouts[1].vsplit(self.widgets[0], self.widgets[6])
+        self.assertCountEqual(self.layout._get_state(),
+                              self.layouts[1]._get_state())
+
+    def test_queries(self):
+        with self.layout.batch():
+            self.layout.remove_widget(self.widgets[0])
+            self.assertIs(self.layout.get_top_neighbour(self.widgets[2]),
+                          self.widgets[1])
+            self.assertTrue(self.layout.can_hsplit(self.widgets[2]))
+            with self.layout.batch():
+                new_widget = self.layout.vsplit(self.widgets[2],
+                                                lambda pos: Widget(pos))
+            self.assertEqual(self.layout._get_state(), self.state)
+        self.assertEqual(self.layout._get_item_position(new_widget, False),
+                         new_widget.name)
+
+
+class AsyncTestCase(unittest.TestCase):
+
+    #  ┌───────┐
+    #  │   0   │
+    #  ├───────┤
+    #  │   1   │
+    #  └───────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingLayout(max_span=2)
+        self.layout.addWidget(self.ws[0], 0, 0, 1, 2)
+        self.layout.addWidget(self.ws[1], 1, 0, 1, 2)
+
+    def _wait(self, future):
+        deadline = time.monotonic() + 5
+        while not future.done() and time.monotonic() < deadline:
+            self.app.processEvents()
+        self.assertTrue(future.done())
+
+    def test_vsplit_async(self):
+        future = self.layout.vsplit_async(self.ws[0], self.ws[2])
+        self.assertEqual(self.layout.count(), 2)
+        self._wait(future)
+        self.assertIs(future.result(), self.ws[2])
+        self.assertEqual(self.layout._get_item_position(self.ws[0], False),
+                         (0, 0, 1, 1))
+        self.assertEqual(self.layout._get_item_position(self.ws[2], False),
+                         (0, 1, 1, 1))
+
+    def test_factory(self):
+        future = self.layout.vsplit_async(self.ws[1], lambda pos: Widget(pos),
+                                          True)
+        self._wait(future)
+        new_widget = future.result()
+        self.assertEqual(new_widget.name, (1, 0, 1, 1))
+        self.assertEqual(self.layout._get_item_position(new_widget, False),
+                         (1, 0, 1, 1))
+
+    def test_shared_executor(self):
+        other = QTilingLayout(initial_widget=Widget('other'), max_span=2)
+        futures = [self.layout.vsplit_async(self.ws[0], self.ws[2]),
+                   other.hsplit_async(other.itemAt(0).widget(), self.ws[3])]
+        for future in futures:
+            self._wait(future)
+        self.assertIsNotNone(self.layout._executor)
+        self.assertIs(self.layout._executor, other._executor)
+        self.assertEqual(other.count(), 2)
+
+    def test_remove_widget_async(self):
+        future = self.layout.remove_widget_async(self.ws[0])
+        self._wait(future)
+        self.assertIsNone(future.result())
+        self.assertTrue(self.ws[0].isHidden())
+        self.assertEqual(self.layout._get_state(), [(self.ws[1],
+                                                     (0, 0, 2, 2))])
+
+    def test_split_limit(self):
+        future = self.layout.hsplit_async(self.ws[0], self.ws[2])
+        self._wait(future)
+        self.assertIsInstance(future.exception(), SplitLimitException)
+        self.assertEqual(self.layout.count(), 2)
+
+    def test_retry(self):
+        future = self.layout.vsplit_async(self.ws[0], self.ws[2])
+        self.layout.vsplit(self.ws[1], self.ws[3])
+        self._wait(future)
+        self.assertCountEqual(self.layout._get_state(),
+                              [(self.ws[0], (0, 0, 1, 1)),
+                               (self.ws[1], (1, 0, 1, 1)),
+                               (self.ws[2], (0, 1, 1, 1)),
+                               (self.ws[3], (1, 1, 1, 1))])
+
+    def test_span_taken_with_state(self):
+        computed = []
+        self.layout._computed.disconnect()
+        self.layout._computed.connect(computed.append)
+        placeholder = object()
+        async_input = self.layout._get_async_input()
+        # The resolution changes before the worker computes the operation
+        self.layout.max_span = 4
+        self.layout._compute_async(
+            Future(), ('vsplit', self.ws[0], self.ws[2], False, placeholder),
+            async_input)
+        self.layout.max_span = 2
+        _, _, used_input, (max_span, result) = computed[0]
+        self.assertEqual(used_input, async_input)
+        self.assertEqual(max_span, 2)
+        self.assertCountEqual(result, [(self.ws[0], (0, 0, 1, 1)),
+                                       (placeholder, (0, 1, 1, 1)),
+                                       (self.ws[1], (1, 0, 1, 2))])
+
+    def test_maximized_before_commit(self):
+        future = self.layout.vsplit_async(self.ws[0], self.ws[2])
+        self.layout.maximize(self.ws[1])
+        self._wait(future)
+        self.assertIs(future.result(), self.ws[2])
+        self.assertFalse(self.layout.is_maximized())
+        self.assertCountEqual(self.layout._get_state(),
+                              [(self.ws[0], (0, 0, 1, 1)),
+                               (self.ws[1], (1, 0, 1, 2)),
+                               (self.ws[2], (0, 1, 1, 1))])
+
+
+class LayoutChangedTestCase(unittest.TestCase):
+
+    #  ┌───┬──────────┐
+    #  │   │    1     │
+    #  │ 0 ├───┬──────┤
+    #  │   │ 2 │      │
+    #  ├───┴───┤      │
+    #  │       │  3   │
+    #  │   4   │      │
+    #  │       │      │
+    #  └───────┴──────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.widgets = [Widget(i) for i in range(6)]
+        self.layout = QTilingLayout(max_span=4)
+        self.layout.addWidget(self.widgets[0], 0, 0, 2, 1)
+        self.layout.addWidget(self.widgets[1], 0, 1, 1, 3)
+        self.layout.addWidget(self.widgets[2], 1, 1, 1, 1)
+        self.layout.addWidget(self.widgets[3], 1, 2, 3, 2)
+        self.layout.addWidget(self.widgets[4], 2, 0, 2, 2)
+        self.diffs = []
+        self.layout.layoutChanged.connect(self.diffs.append)
+
+    def test_between(self):
+        diff = LayoutDiff.between([('a', (0, 0, 1, 2)), ('b', (1, 0, 1, 2))],
+                                  [('a', (0, 0, 2, 1)), ('c', (0, 1, 2, 1))])
+        self.assertEqual(diff, ([('c', (0, 1, 2, 1))],
+                                [('b', (1, 0, 1, 2))],
+                                [('a', (0, 0, 1, 2), (0, 0, 2, 1))]))
+        self.assertFalse(LayoutDiff.between([('a', (0, 0, 1, 1))],
+                                            [('a', (0, 0, 1, 1))]))
+
+    def test_remove(self):
+        self.layout.remove_widget(self.widgets[4])
+        self.assertEqual(len(self.diffs), 1)
+        diff = self.diffs[0]
+        self.assertEqual(diff.added, [])
+        self.assertEqual(diff.removed, [(self.widgets[4], (2, 0, 2, 2))])
+        self.assertCountEqual(diff.moved, [
+            (self.widgets[0], (0, 0, 2, 1), (0, 0, 4, 2)),
+            (self.widgets[1], (0, 1, 1, 3), (0, 2, 2, 2)),
+            (self.widgets[2], (1, 1, 1, 1), (2, 2, 2, 1)),
+            (self.widgets[3], (1, 2, 3, 2), (2, 3, 2, 1)),
+        ])
+
+    def test_split(self):
+        state = self.layout._get_state()
+        self.layout.hsplit(self.widgets[3], self.widgets[5])
+        self.assertEqual(self.diffs, [LayoutDiff.between(
+            state, self.layout._get_state())])
+        self.assertEqual(self.diffs[0].added, [(self.widgets[5],
+                                                (3, 2, 1, 2))])
+        self.assertEqual(self.diffs[0].removed, [])
+
+    def test_failed_split(self):
+        layout = QTilingLayout(max_span=2)
+        layout.addWidget(self.widgets[5], 0, 0, 2, 2)
+        layout.hsplit(self.widgets[5], lambda pos: Widget('new'))
+        layout.layoutChanged.connect(self.diffs.append)
+        with self.assertRaises(SplitLimitException):
+            layout.hsplit(self.widgets[5], Widget('new'))
+        self.assertEqual(self.diffs, [])
+
+    def test_batch(self):
+        with self.layout.batch():
+            self.assertTrue(self.layout.can_remove(self.widgets[0]))
+        self.assertEqual(self.diffs, [])
+        with self.layout.batch():
+            self.layout.hsplit(self.widgets[3], self.widgets[5])
+            self.layout.vsplit(self.widgets[1], lambda pos: Widget('new'))
+        self.assertEqual(len(self.diffs), 1)
+        self.assertEqual(len(self.diffs[0].added), 2)
+
+
+class ValidationTestCase(unittest.TestCase):
+
+    #  ┌───┬──────────┐
+    #  │   │    1     │
+    #  │ 0 ├───┬──────┤
+    #  │   │ 2 │      │
+    #  ├───┴───┤      │
+    #  │       │  3   │
+    #  │   4   │      │
+    #  │       │      │
+    #  └───────┴──────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.layouts = {}
+        self.widgets = {}
+        for policy in QTilingLayout.VALIDATION_POLICIES:
+            ws = [Widget(i) for i in range(5)]
+            layout = QTilingLayout(max_span=4, validation=policy)
+            layout.addWidget(ws[0], 0, 0, 2, 1)
+            layout.addWidget(ws[1], 0, 1, 1, 3)
+            layout.addWidget(ws[2], 1, 1, 1, 1)
+            layout.addWidget(ws[3], 1, 2, 3, 2)
+            layout.addWidget(ws[4], 2, 0, 2, 2)
+            self.layouts[policy] = layout
+            self.widgets[policy] = ws
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError) as cm:
+            QTilingLayout(validation='lenient')
+        self.assertEqual(str(cm.exception),
+                         '"validation" must be one of '
+                         "('strict', 'trusted', 'end-of-op')")
+
+    def test_same_results(self):
+        for policy, layout in self.layouts.items():
+            layout.vsplit(self.widgets[policy][2], Widget('new'))
+            layout.remove_widget(self.widgets[policy][0])
+        states = [[pos for _, pos in layout._get_state()]
+                  for layout in self.layouts.values()]
+        self.assertEqual(states[0], states[1])
+        self.assertEqual(states[0], states[2])
+
+    def test_trusted_skips_checks(self):
+        calls = {policy: record_calls(layout, 'itemAtPosition')
+                 for policy, layout in self.layouts.items()}
+        for policy, layout in self.layouts.items():
+            layout.hsplit(self.widgets[policy][3], Widget('new'))
+        self.assertLess(len(calls['trusted']), len(calls['strict']))
+        self.assertLess(len(calls['end-of-op']), len(calls['strict']))
+
+    def test_checks_outside_operations(self):
+        for layout in self.layouts.values():
+            with self.assertRaises(WidgetOverlapException):
+                layout._add_widget(Widget('new'), 1, 1, 2, 2, False)
+
+    def test_end_of_op_verification(self):
+        def leave_gap(self, widgets, domain):
+            for widget, _ in widgets:
+                self.removeWidget(widget)
+
+        for layout in self.layouts.values():
+            layout._rearrange_widgets = types.MethodType(leave_gap, layout)
+        self.layouts['trusted'].check_invariants = False
+        self.layouts['trusted'].hsplit(self.widgets['trusted'][0],
+                                       Widget('new'))
+        with self.assertRaises(SplitException) as cm:
+            self.layouts['end-of-op'].hsplit(self.widgets['end-of-op'][0],
+                                             Widget('new'))
+        self.assertIsInstance(cm.exception.__cause__,
+                              EmptySpaceInLayoutException)
+
+    def test_verify_tiling(self):
+        layout = self.layouts['strict']
+        layout._verify_tiling()
+        layout.addWidget(Widget('new'), 0, 0, 1, 1)
+        with self.assertRaises(WidgetOverlapException):
+            layout._verify_tiling()
+        layout.removeWidget(self.widgets['strict'][0])
+        with self.assertRaises(EmptySpaceInLayoutException):
+            layout._verify_tiling()
+
+
 class RemoveTestCase(unittest.TestCase):
 
     #  ┌───┬──────────┐
@@ -408,6 +1010,78 @@ class RemoveTestCase(unittest.TestCase):
         )
 
 
+class WorkspaceTestCase(unittest.TestCase):
+
+    #  ┌───┬───┐   ┌───────┐
+    #  │   │   │   │   2   │
+    #  │ 0 │ 1 │   ├───────┤
+    #  │   │   │   │   3   │
+    #  └───┴───┘   └───────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(4)]
+        self.layouts = [QTilingLayout(max_span=2), QTilingLayout(max_span=2)]
+        self.layouts[0].addWidget(self.ws[0], 0, 0, 2, 1)
+        self.layouts[0].addWidget(self.ws[1], 0, 1, 2, 1)
+        self.layouts[1].addWidget(self.ws[2], 0, 0, 1, 2)
+        self.layouts[1].addWidget(self.ws[3], 1, 0, 1, 2)
+        self.states = [layout._get_state() for layout in self.layouts]
+        self.manager = WorkspaceManager()
+        for layout in self.layouts:
+            self.manager.add_workspace(layout)
+
+    def test_add_workspace(self):
+        self.assertIs(self.manager.current, self.layouts[0])
+        self.assertFalse(self.layouts[0].is_detached())
+        self.assertTrue(self.layouts[1].is_detached())
+        self.assertEqual(self.layouts[0]._get_state(), self.states[0])
+        self.assertEqual(self.layouts[1].count(), 0)
+        self.assertTrue(self.ws[2].isHidden())
+        self.assertTrue(self.ws[3].isHidden())
+
+    def test_set_current(self):
+        self.manager.set_current(self.layouts[1])
+        self.assertIs(self.manager.current, self.layouts[1])
+        self.assertEqual(self.layouts[0].count(), 0)
+        self.assertEqual(self.layouts[1]._get_state(), self.states[1])
+        self.assertFalse(self.ws[2].isHidden())
+        self.manager.set_current(self.layouts[0])
+        self.assertEqual(self.layouts[0]._get_state(), self.states[0])
+        self.assertEqual(self.layouts[1].count(), 0)
+
+    def test_set_unknown_current(self):
+        with self.assertRaises(ValueError):
+            self.manager.set_current(QTilingLayout())
+
+    def test_remove_workspace(self):
+        self.manager.remove_workspace(self.layouts[0])
+        self.assertIs(self.manager.current, self.layouts[1])
+        self.assertEqual(self.layouts[0]._get_state(), self.states[0])
+        self.assertEqual(self.layouts[1]._get_state(), self.states[1])
+
+    def test_operations_on_detached_layout(self):
+        layout = self.layouts[1]
+        new_widget = Widget('new')
+        self.assertIs(layout.get_bottom_neighbour(self.ws[2]), self.ws[3])
+        layout.vsplit(self.ws[2], new_widget)
+        layout.remove_widget(self.ws[3])
+        self.assertIs(layout.get_right_neighbour(self.ws[2]), new_widget)
+        self.assertTrue(layout.is_detached())
+        self.assertEqual(layout.count(), 0)
+        with layout.batch():
+            layout.hsplit(self.ws[2], self.ws[3])
+        self.assertEqual(layout.count(), 0)
+        with self.assertRaises(RuntimeError):
+            layout.maximize(self.ws[2])
+        self.manager.set_current(layout)
+        self.assertCountEqual(layout._get_state(),
+                              [(self.ws[2], (0, 0, 1, 1)),
+                               (self.ws[3], (1, 0, 1, 1)),
+                               (new_widget, (0, 1, 2, 1))])
+        self.assertFalse(new_widget.isHidden())
+        self.assertTrue(self.layouts[0].is_detached())
+
+
 class IndependentBlockTestCase(unittest.TestCase):
 
     #  ┌───┬───────┬───────┬───┐
@@ -1111,5 +1785,1344 @@ class NeighbourTestCase(unittest.TestCase):
                          self.ws[16])
 
 
+class NavigationIndexTestCase(unittest.TestCase):
+
+    # Same layout as NeighbourTestCase
+    def setUp(self):
+        NeighbourTestCase.setUp(self)
+        self.index = NavigationIndex(self.layout)
+        self.getters = {'left': self.layout.get_left_neighbour,
+                        'top': self.layout.get_top_neighbour,
+                        'right': self.layout.get_right_neighbour,
+                        'bottom': self.layout.get_bottom_neighbour}
+
+    def _assert_same_as_layout(self):
+        for widget, _ in self.layout._get_state():
+            for direction, getter in self.getters.items():
+                self.assertIs(self.index.neighbour(widget, direction),
+                              getter(widget))
+
+    def test_same_as_layout(self):
+        self._assert_same_as_layout()
+
+    def test_wrap(self):
+        self.assertIs(self.index.neighbour(self.ws[0], 'left', True),
+                      self.ws[10])
+        self.assertIs(self.index.neighbour(self.ws[0], 'top', True),
+                      self.ws[18])
+        self.assertIs(self.index.neighbour(self.ws[17], 'right', True),
+                      self.ws[6])
+        self.assertIs(self.index.neighbour(self.ws[18], 'bottom', True),
+                      self.ws[1])
+        self.assertIsNone(self.index.neighbour(self.ws[18], 'left', True))
+        self.assertIs(self.index.neighbour(self.ws[3], 'left', True),
+                      self.ws[2])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.index.neighbour(self.ws[0], 'up')
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.index.neighbour(Widget(''), 'left')
+
+    def test_update(self):
+        self.layout.vsplit(self.ws[3], Widget('new'))
+        self.layout.remove_widget(self.ws[12])
+        self.layout.hsplit(self.ws[18], Widget('new'), True)
+        self._assert_same_as_layout()
+        positions = self.index._positions
+        self.index.rebuild()
+        self.assertEqual(self.index._positions, positions)
+
+
+class MoveBoundaryTestCase(unittest.TestCase):
+
+    # Same layout as NeighbourTestCase
+    def setUp(self):
+        NeighbourTestCase.setUp(self)
+        self.state = self.layout._get_state()
+
+    def _assert_positions(self, positions):
+        self.layout._verify_tiling()
+        for widget, pos in self.layout._get_state():
+            self.assertEqual(pos, positions.get(widget.name,
+                                                dict(self.state)[widget]))
+
+    def test_shrink_right(self):
+        self.layout.move_boundary(self.ws[3], 'right', -1)
+        self._assert_positions({3: (1, 1, 3, 2), 4: (1, 3, 1, 2),
+                                5: (2, 3, 2, 2)})
+
+    def test_grow_bottom(self):
+        self.layout.move_boundary(self.ws[2], 'bottom', 1)
+        self._assert_positions({2: (1, 0, 3, 1), 6: (4, 0, 1, 1)})
+
+    def test_extended_edge(self):
+        self.layout.move_boundary(self.ws[18], 'top', -1)
+        self._assert_positions({18: (6, 0, 3, 9), 6: (3, 0, 3, 1),
+                                7: (4, 1, 2, 2), 8: (4, 3, 2, 2),
+                                14: (2, 5, 4, 1), 16: (3, 6, 3, 1),
+                                17: (3, 7, 3, 2)})
+
+    def test_split_limit(self):
+        with self.assertRaises(SplitLimitException):
+            self.layout.move_boundary(self.ws[3], 'right', 1)
+        with self.assertRaises(SplitLimitException):
+            self.layout.move_boundary(self.ws[12], 'left', -1)
+        with self.assertRaises(SplitLimitException):
+            self.layout.move_boundary(self.ws[0], 'left', 1)
+        self.assertEqual(self.layout._get_state(), self.state)
+
+    def test_invalid_direction(self):
+        with self.assertRaises(ValueError):
+            self.layout.move_boundary(self.ws[0], 'up', 1)
+
+    def test_only_edge_widgets(self):
+        calls = record_calls(self.layout, 'removeWidget')
+        self.layout.move_boundary(self.ws[2], 'bottom', 1)
+        self.assertCountEqual([args[0] for _, args in calls],
+                              [self.ws[2], self.ws[6]])
+
+
+class SwapAndMoveTestCase(unittest.TestCase):
+
+    #  ┌───┬──────────┐
+    #  │   │    1     │
+    #  │ 0 ├───┬──────┤
+    #  │   │ 2 │      │
+    #  ├───┴───┤      │
+    #  │       │  3   │
+    #  │   4   │      │
+    #  │       │      │
+    #  └───────┴──────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.widgets = [Widget(i) for i in range(5)]
+        self.layouts = [QTilingLayout(max_span=4), QTilingLayout(max_span=4)]
+        for layout in self.layouts:
+            layout.addWidget(self.widgets[0], 0, 0, 2, 1)
+            layout.addWidget(self.widgets[1], 0, 1, 1, 3)
+            layout.addWidget(self.widgets[2], 1, 1, 1, 1)
+            layout.addWidget(self.widgets[3], 1, 2, 3, 2)
+            layout.addWidget(self.widgets[4], 2, 0, 2, 2)
+        self.layout = self.layouts[0]
+        self.diffs = []
+        self.layout.layoutChanged.connect(self.diffs.append)
+
+    def test_swap_widgets(self):
+        self.layout.swap_widgets(self.widgets[0], self.widgets[3])
+        self.assertEqual(self.layout._get_item_position(self.widgets[0],
+                                                        False),
+                         (1, 2, 3, 2))
+        self.assertEqual(self.layout._get_item_position(self.widgets[3],
+                                                        False),
+                         (0, 0, 2, 1))
+        self.assertEqual(len(self.diffs), 1)
+        self.assertEqual(len(self.diffs[0].moved), 2)
+
+    def test_swap_widget_with_itself(self):
+        state = self.layout._get_state()
+        for validation in QTilingLayout.VALIDATION_POLICIES:
+            self.layout.validation = validation
+            self.layout.swap_widgets(self.widgets[2], self.widgets[2])
+            self.assertEqual(self.layout._get_state(), state)
+        self.assertEqual(self.diffs, [])
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.layout.swap_widgets(Widget('new'), Widget('new'))
+
+    def test_move_widget(self):
+        self.layout.move_widget(self.widgets[0], self.widgets[3], 'right')
+        self.layouts[1].remove_widget(self.widgets[0])
+        self.layouts[1].vsplit(self.widgets[3], self.widgets[0])
+        self.assertCountEqual(self.layout._get_state(),
+                              self.layouts[1]._get_state())
+        self.assertEqual(len(self.diffs), 1)
+        self.assertEqual(self.diffs[0].added, [])
+        self.assertEqual(self.diffs[0].removed, [])
+
+    def test_move_widget_before(self):
+        self.layout.move_widget(self.widgets[4], self.widgets[1], 'top')
+        self.layouts[1].remove_widget(self.widgets[4])
+        self.layouts[1].hsplit(self.widgets[1], self.widgets[4], True)
+        self.assertCountEqual(self.layout._get_state(),
+                              self.layouts[1]._get_state())
+
+    def test_failed_move_widget(self):
+        state = self.layout._get_state()
+        with self.assertRaises(SplitLimitException):
+            for widget in self.widgets[1:]:
+                self.layout.move_widget(widget, self.widgets[0], 'bottom')
+        self.assertEqual(len(self.layout._get_state()), 5)
+        with self.assertRaises(ValueError):
+            self.layout.move_widget(self.widgets[0], self.widgets[0], 'top')
+        with self.assertRaises(ValueError):
+            self.layout.move_widget(self.widgets[0], self.widgets[1], 'up')
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.layout.move_widget(self.widgets[0], Widget('new'), 'top')
+        self.assertEqual(len(self.layout._get_state()), 5)
+
+    def test_batch(self):
+        with self.layout.batch():
+            self.layout.swap_widgets(self.widgets[0], self.widgets[3])
+            self.layout.move_widget(self.widgets[1], self.widgets[2], 'left')
+            self.assertEqual(self.diffs, [])
+        self.assertEqual(len(self.diffs), 1)
+        self.layout._verify_tiling()
+
+
+class MaximizeTestCase(unittest.TestCase):
+
+    #  ┌───┬──────────┐
+    #  │   │    1     │
+    #  │ 0 ├───┬──────┤
+    #  │   │ 2 │      │
+    #  ├───┴───┤      │
+    #  │       │  3   │
+    #  │   4   │      │
+    #  │       │      │
+    #  └───────┴──────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.widgets = [Widget(i) for i in range(6)]
+        self.layout = QTilingLayout(max_span=4)
+        self.layout.addWidget(self.widgets[0], 0, 0, 2, 1)
+        self.layout.addWidget(self.widgets[1], 0, 1, 1, 3)
+        self.layout.addWidget(self.widgets[2], 1, 1, 1, 1)
+        self.layout.addWidget(self.widgets[3], 1, 2, 3, 2)
+        self.layout.addWidget(self.widgets[4], 2, 0, 2, 2)
+        self.state = self.layout._get_state()
+
+    def test_maximize(self):
+        self.layout.maximize(self.widgets[2])
+        self.assertTrue(self.layout.is_maximized())
+        self.assertEqual(self.layout._get_state(),
+                         [(self.widgets[2], (0, 0, 4, 4))])
+
+    def test_restore(self):
+        self.layout.maximize(self.widgets[2])
+        self.layout.maximize(self.widgets[3])
+        self.layout.restore()
+        self.assertFalse(self.layout.is_maximized())
+        self.assertEqual(self.layout._get_state(), self.state)
+        self.layout.restore()
+        self.assertEqual(self.layout._get_state(), self.state)
+
+    def test_invalid_widget(self):
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.layout.maximize(Widget('new'))
+        self.assertEqual(self.layout._get_state(), self.state)
+
+    def test_operation_restores(self):
+        self.layout.maximize(self.widgets[2])
+        self.layout.vsplit(self.widgets[2], self.widgets[5])
+        self.assertFalse(self.layout.is_maximized())
+        self.assertEqual(self.layout.count(), 6)
+        self.layout._verify_tiling()
+
+    def test_queries_see_restored_layout(self):
+        layout = QTilingLayout(max_span=2)
+        layout.addWidget(self.widgets[0], 0, 0, 2, 1)
+        layout.addWidget(self.widgets[1], 0, 1, 2, 1)
+        layout.maximize(self.widgets[0])
+        self.assertFalse(layout.can_vsplit(self.widgets[0]))
+        self.assertIsNone(layout.preview('vsplit', self.widgets[0]))
+        self.assertTrue(layout.can_remove(self.widgets[1]))
+        self.assertTrue(layout.is_maximized())
+        with self.assertRaises(SplitLimitException):
+            layout.vsplit(self.widgets[0], self.widgets[5])
+
+    def test_not_in_batch(self):
+        with self.layout.batch():
+            self.layout.vsplit(self.widgets[2], self.widgets[5])
+            with self.assertRaises(RuntimeError):
+                self.layout.maximize(self.widgets[0])
+        self.assertFalse(self.layout.is_maximized())
+        self.assertEqual(self.layout.count(), 6)
+        self.layout._verify_tiling()
+
+
+class EqualizeTestCase(unittest.TestCase):
+
+    #  ┌─┬─────┬─┐
+    #  │0│  1  │2│
+    #  ├─┴─────┴─┤
+    #  │    3    │
+    #  │         │
+    #  │         │
+    #  ├─────────┤
+    #  │    4    │
+    #  └─────────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(5)]
+        self.layout = QTilingLayout(max_span=6)
+        self.layout.addWidget(self.ws[0], 0, 0, 1, 1)
+        self.layout.addWidget(self.ws[1], 0, 1, 1, 4)
+        self.layout.addWidget(self.ws[2], 0, 5, 1, 1)
+        self.layout.addWidget(self.ws[3], 1, 0, 4, 6)
+        self.layout.addWidget(self.ws[4], 5, 0, 1, 6)
+        self.diffs = []
+        self.layout.layoutChanged.connect(self.diffs.append)
+
+    def _positions(self):
+        return [pos for _, pos in sorted(self.layout._get_state(),
+                                         key=lambda item: item[0].name)]
+
+    def test_vequalize(self):
+        self.layout.vequalize()
+        self.assertEqual(self._positions(), [(0, 0, 1, 2), (0, 2, 1, 2),
+                                             (0, 4, 1, 2), (1, 0, 4, 6),
+                                             (5, 0, 1, 6)])
+        self.assertEqual(len(self.diffs), 1)
+
+    def test_hequalize(self):
+        self.layout.hequalize()
+        self.assertEqual(self._positions(), [(0, 0, 2, 1), (0, 1, 2, 4),
+                                             (0, 5, 2, 1), (2, 0, 2, 6),
+                                             (4, 0, 2, 6)])
+
+    def test_equalize(self):
+        self.layout.equalize()
+        self.assertEqual(self._positions(), [(0, 0, 2, 2), (0, 2, 2, 2),
+                                             (0, 4, 2, 2), (2, 0, 2, 6),
+                                             (4, 0, 2, 6)])
+        self.assertEqual(len(self.diffs), 1)
+
+    def test_rigid_region(self):
+        #  ┌───────┬───┐
+        #  │   0   │   │
+        #  ├───┬───┤ 1 │
+        #  │   │ 4 │   │
+        #  │ 3 ├───┴───┤
+        #  │   │   2   │
+        #  └───┴───────┘
+        layout = QTilingLayout(max_span=3)
+        layout.addWidget(self.ws[0], 0, 0, 1, 2)
+        layout.addWidget(self.ws[1], 0, 2, 2, 1)
+        layout.addWidget(self.ws[2], 2, 1, 1, 2)
+        layout.addWidget(self.ws[3], 1, 0, 2, 1)
+        layout.addWidget(self.ws[4], 1, 1, 1, 1)
+        state = layout._get_state()
+        layout.equalize()
+        self.assertEqual(layout._get_state(), state)
+
+
+class AdaptiveResolutionTestCase(unittest.TestCase):
+
+    #  ┌───┬───┐
+    #  │ 0 │ 1 │
+    #  ├───┴───┤
+    #  │   2   │
+    #  └───────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingLayout(max_span=2, adaptive=True)
+        self.layout.addWidget(self.ws[0], 0, 0, 1, 1)
+        self.layout.addWidget(self.ws[1], 0, 1, 1, 1)
+        self.layout.addWidget(self.ws[2], 1, 0, 1, 2)
+
+    def test_refine_on_limit(self):
+        #  ┌───┬───┐
+        #  │ 0 │   │
+        #  ├───┤ 1 │
+        #  │ 3 │   │
+        #  ├───┴───┤
+        #  │   2   │
+        #  └───────┘
+        self.layout.hsplit(self.ws[0], self.ws[3])
+        self.assertEqual(self.layout.max_span, 4)
+        self.assertEqual(sorted((w.name, pos) for w, pos
+                                in self.layout._get_state()),
+                         [(0, (0, 0, 2, 2)), (1, (0, 2, 3, 2)),
+                          (2, (3, 0, 1, 4)), (3, (2, 0, 1, 2))])
+        self.layout._verify_tiling()
+
+    def test_coarsen_on_remove(self):
+        state = self.layout._get_state()
+        self.layout.hsplit(self.ws[0], self.ws[3])
+        self.layout.remove_widget(self.ws[3])
+        self.assertEqual(self.layout.max_span, 2)
+        self.assertCountEqual(self.layout._get_state(), state)
+
+    def test_coarsen_keeps_geometry(self):
+        parent = QWidget()
+        parent.setLayout(self.layout)
+        parent.resize(200, 100)
+        parent.show()
+        self.layout.activate()
+        geometries = [widget.geometry() for widget in self.ws[:3]]
+        self.layout.hsplit(self.ws[0], self.ws[3])
+        self.layout.remove_widget(self.ws[3])
+        self.layout.activate()
+        self.assertEqual([widget.geometry() for widget in self.ws[:3]],
+                         geometries)
+        # QGridLayout never forgets rows or columns, but they stay empty
+        for i in range(self.layout.rowCount()):
+            for j in range(self.layout.columnCount()):
+                if i >= self.layout.max_span or j >= self.layout.max_span:
+                    self.assertIsNone(self.layout.itemAtPosition(i, j))
+
+    def test_queries_on_remove(self):
+        self.layout.hsplit(self.ws[0], self.ws[3])
+        diff = self.layout.preview('remove_widget', self.ws[3])
+        possible, geometry = self.layout.can_remove(self.ws[3], True)
+        self.layout.remove_widget(self.ws[3])
+        self.assertTrue(possible)
+        self.assertCountEqual(geometry, self.layout._get_state())
+        self.assertEqual(diff.removed, [(self.ws[3], (2, 0, 1, 2))])
+        self.assertCountEqual([(widget, pos) for widget, _, pos in diff.moved],
+                              self.layout._get_state())
+
+    def test_not_adaptive(self):
+        self.layout.adaptive = False
+        state = self.layout._get_state()
+        with self.assertRaises(SplitLimitException):
+            self.layout.hsplit(self.ws[0], self.ws[3])
+        self.assertEqual(self.layout.max_span, 2)
+        self.assertEqual(self.layout._get_state(), state)
+
+    def test_batch(self):
+        with self.layout.batch():
+            self.layout.hsplit(self.ws[0], self.ws[3])
+            self.assertEqual(self.layout.max_span, 4)
+        self.assertEqual(self.layout.max_span, 4)
+        self.assertEqual(self.layout.count(), 4)
+        self.layout._verify_tiling()
+
+    def test_failed_batch(self):
+        state = self.layout._get_state()
+        with self.assertRaises(ValueError):
+            with self.layout.batch():
+                self.layout.hsplit(self.ws[0], self.ws[3])
+                raise ValueError
+        self.assertEqual(self.layout.max_span, 2)
+        self.assertEqual(self.layout._get_state(), state)
+
+    def _refined_state(self):
+        layout = QTilingLayout(max_span=2, adaptive=True)
+        for widget, pos in self.layout._get_state():
+            layout.addWidget(widget, *pos)
+        layout.hsplit(self.ws[0], self.ws[3])
+        return layout._get_state()
+
+    def test_queries(self):
+        refined_state = self._refined_state()
+        self.assertTrue(self.layout.can_hsplit(self.ws[0]))
+        self.assertCountEqual(
+            self.layout.can_hsplit(self.ws[0], return_geometry=True)[1],
+            [(None if w is self.ws[3] else w, pos)
+             for w, pos in refined_state])
+        diff = self.layout.preview('hsplit', self.ws[0])
+        self.assertEqual(diff.added, [(None, dict(refined_state)[self.ws[3]])])
+        self.assertEqual(len(diff.moved), 3)
+        self.assertEqual(self.layout.max_span, 2)
+        self.layout.adaptive = False
+        self.assertFalse(self.layout.can_hsplit(self.ws[0]))
+
+    def test_async(self):
+        refined_state = self._refined_state()
+        future = self.layout.hsplit_async(self.ws[0], self.ws[3])
+        deadline = time.monotonic() + 5
+        while not future.done() and time.monotonic() < deadline:
+            self.app.processEvents()
+        self.assertIs(future.result(), self.ws[3])
+        self.assertEqual(self.layout.max_span, 4)
+        self.assertCountEqual(self.layout._get_state(), refined_state)
+        future = self.layout.remove_widget_async(self.ws[3])
+        deadline = time.monotonic() + 5
+        while not future.done() and time.monotonic() < deadline:
+            self.app.processEvents()
+        self.assertEqual(self.layout.max_span, 2)
+
+    def test_move_widget(self):
+        #  ┌───┬───┐
+        #  │ 1 │   │
+        #  ├───┤ 0 │
+        #  │ 2 │   │
+        #  └───┴───┘
+        self.layout.move_widget(self.ws[1], self.ws[2], 'top')
+        self.assertEqual(self.layout.max_span, 4)
+        self.layout._verify_tiling()
+
+
+class GeometryLayoutTestCase(unittest.TestCase):
+
+    #  ┌───┬───┐
+    #  │ 0 │ 1 │
+    #  ├───┴───┤
+    #  │   2   │
+    #  │       │
+    #  └───────┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.parent = QWidget()
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingGeometryLayout(self.parent, max_span=3)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.setSpacing(0)
+        self.layout.addWidget(self.ws[0], 0, 0, 1, 1)
+        self.layout.addWidget(self.ws[1], 0, 1, 1, 2)
+        self.layout.addWidget(self.ws[2], 1, 0, 2, 3)
+
+    def test_geometries(self):
+        self.layout.setGeometry(QRect(0, 0, 90, 60))
+        self.assertEqual(self.ws[0].geometry(), QRect(0, 0, 30, 20))
+        self.assertEqual(self.ws[1].geometry(), QRect(30, 0, 60, 20))
+        self.assertEqual(self.ws[2].geometry(), QRect(0, 20, 90, 40))
+
+    def test_spacing_and_margins(self):
+        self.layout.setContentsMargins(1, 2, 1, 2)
+        self.layout.setSpacing(2)
+        self.layout.setGeometry(QRect(0, 0, 90, 68))
+        self.assertEqual(self.ws[0].geometry(), QRect(1, 2, 28, 20))
+        self.assertEqual(self.ws[1].geometry(), QRect(31, 2, 58, 20))
+        self.assertEqual(self.ws[2].geometry(), QRect(1, 24, 88, 42))
+
+    def test_deleted_widget(self):
+        for layout_class in (QTilingLayout, QTilingGeometryLayout):
+            parent = QWidget()
+            widgets = [Widget(i) for i in range(3)]
+            layout = layout_class(parent, max_span=2)
+            layout.addWidget(widgets[0], 0, 0, 1, 2)
+            layout.addWidget(widgets[1], 1, 0, 1, 1)
+            layout.addWidget(widgets[2], 1, 1, 1, 1)
+            sip.delete(widgets[1])
+            widgets[2].deleteLater()
+            self.app.sendPostedEvents(None, QEvent.DeferredDelete)
+            self.assertEqual(layout.count(), 1)
+            self.assertIsNone(layout.itemAtPosition(1, 0))
+            self.assertIsNone(layout.itemAtPosition(1, 1))
+            self.assertIs(layout.itemAtPosition(0, 1).widget(), widgets[0])
+            self.assertEqual(layout.indexOf(widgets[0]), 0)
+
+    def test_operations(self):
+        self.layout.vsplit(self.ws[2], self.ws[3])
+        self.layout.setGeometry(QRect(0, 0, 90, 60))
+        self.assertEqual(self.layout.itemAtPosition(2, 2).widget(),
+                         self.ws[3])
+        self.assertEqual(self.layout.indexOf(self.ws[3]), 3)
+        self.layout.remove_widget(self.ws[0])
+        self.assertEqual(self.layout.indexOf(self.ws[0]), -1)
+        self.assertIsNone(self.layout.itemAtPosition(3, 0))
+        self.layout._verify_tiling()
+        self.layout.setGeometry(QRect(0, 0, 90, 60))
+        for widget, (row, col, rowspan, colspan) in self.layout._get_state():
+            self.assertEqual(widget.geometry(),
+                             QRect(col * 30, row * 20, colspan * 30,
+                                   rowspan * 20))
+
+    def test_reparented_widget(self):
+        self.ws[0].setParent(None)
+        self.assertEqual(self.layout.count(), 2)
+        self.assertIsNone(self.layout.itemAtPosition(0, 0))
+
+
+class InvariantCheckerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(3)]
+        self.layout = QTilingLayout(max_span=4)
+        self.layout.addWidget(self.ws[0], 0, 0, 4, 2)
+        self.layout.addWidget(self.ws[1], 0, 2, 4, 2)
+
+    def test_valid(self):
+        self.layout._verify_tiling()
+
+    def test_overlap(self):
+        self.layout.addWidget(self.ws[2], 1, 1, 1, 2)
+        with self.assertRaises(WidgetOverlapException):
+            self.layout._verify_tiling()
+
+    def test_outside_grid(self):
+        self.layout.removeWidget(self.ws[1])
+        self.layout.addWidget(self.ws[1], 0, 2, 4, 3)
+        with self.assertRaises(WidgetOverlapException):
+            self.layout._verify_tiling()
+
+    def test_empty_space(self):
+        self.layout.removeWidget(self.ws[1])
+        with self.assertRaises(EmptySpaceInLayoutException):
+            self.layout._verify_tiling()
+
+    def test_inconsistent_grid(self):
+        layout = self.layout
+        layout.itemAtPosition = lambda row, col: layout.itemAt(0)
+        with self.assertRaises(InconsistentGridException):
+            layout._verify_tiling()
+
+    def test_checked_after_operations(self):
+        calls = []
+        verify_tiling = self.layout._verify_tiling
+        self.layout._verify_tiling = lambda: calls.append(verify_tiling())
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.swap_widgets(self.ws[0], self.ws[1])
+        self.layout.remove_widget(self.ws[2])
+        self.assertEqual(len(calls), 3)
+        self.layout.check_invariants = False
+        self.layout.vsplit(self.ws[0], self.ws[2])
+        self.assertEqual(len(calls), 3)
+
+
+class TraceRecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingLayout(max_span=2)
+        self.layout.addWidget(self.ws[0], 0, 0, 2, 1)
+        self.layout.addWidget(self.ws[1], 0, 1, 2, 1)
+        self.recorder = TraceRecorder(self.layout)
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.hsplit(self.ws[1], lambda pos: self.ws[3],
+                           put_before=True)
+        self.layout.get_right_neighbour(self.ws[0])
+        with self.assertRaises(SplitLimitException):
+            self.layout.vsplit(self.ws[2], lambda pos: Widget('new'))
+        self.layout.remove_widget(self.ws[0])
+        self.recorder.stop()
+
+    def test_recorded_operations(self):
+        self.assertEqual(self.recorder.initial_state,
+                         [(0, (0, 0, 2, 1)), (1, (0, 1, 2, 1))])
+        operations = [(op.name, op.args, op.kwargs, op.result, op.error)
+                      for op in self.recorder.operations]
+        self.assertEqual(operations, [
+            ('hsplit', [{'w': 0}, {'w': 2}], {}, {'w': 2}, None),
+            ('hsplit', [{'w': 1}, {'w': 3}], {'put_before': True}, {'w': 3},
+             None),
+            ('get_right_neighbour', [{'w': 0}], {}, {'w': 3}, None),
+            ('vsplit', [{'w': 2}, {'w': 4}], {}, None, 'SplitLimitException'),
+            ('remove_widget', [{'w': 0}], {}, None, None)])
+
+    def test_stop(self):
+        self.layout.hsplit(self.ws[2], self.ws[0])
+        self.assertEqual(len(self.recorder.operations), 5)
+
+    def test_save_and_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace')
+            self.recorder.save(path)
+            trace = TraceRecorder.load(path)
+        self.assertEqual(trace.initial_state, self.recorder.initial_state)
+        self.assertEqual([op.error for op in trace.operations],
+                         [op.error for op in self.recorder.operations])
+        widgets = {}
+        layout, replayed = replay_trace(
+            trace, lambda widget_id: widgets.setdefault(widget_id,
+                                                       Widget(widget_id)))
+        self.assertEqual([op.error for op in replayed],
+                         [op.error for op in self.recorder.operations])
+        self.assertCountEqual(
+            [(widget.name, pos) for widget, pos in layout._get_state()],
+            [(widget.name, pos) for widget, pos in self.layout._get_state()])
+
+    def test_every_neighbour_query(self):
+        recorder = TraceRecorder(self.layout)
+        self.layout.get_left_neighbour(self.ws[3])
+        self.layout.get_top_neighbour(self.ws[3])
+        self.layout.get_right_neighbour(self.ws[2])
+        self.layout.get_bottom_neighbour(self.ws[3])
+        self.assertEqual([op.name for op in recorder.operations],
+                         ['get_left_neighbour', 'get_top_neighbour',
+                          'get_right_neighbour', 'get_bottom_neighbour'])
+
+    def test_snapshots(self):
+        snapshot = self.layout.snapshot()
+        recorder = TraceRecorder(self.layout)
+        self.layout.remove_widget(self.ws[2])
+        self.layout.snapshot()
+        self.layout.apply_snapshot(snapshot)
+        recorder.stop()
+        self.assertEqual([op.name for op in recorder.operations],
+                         ['remove_widget', 'snapshot', 'apply_snapshot'])
+        self.assertEqual(recorder.operations[2].args, [{
+            'snapshot': 2,
+            'items': [[{'w': 0}, [1, 1, 1, 1]], [{'w': 1}, [0, 1, 1, 1]],
+                      [{'w': 2}, [0, 0, 2, 1]]]}])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace')
+            recorder.save(path)
+            trace = TraceRecorder.load(path)
+        widgets = {}
+        layout, replayed = replay_trace(
+            trace, lambda widget_id: widgets.setdefault(widget_id,
+                                                       Widget(widget_id)))
+        self.assertEqual([op.error for op in replayed], [None] * 3)
+        self.assertCountEqual(
+            [(widget.name, pos) for widget, pos in layout._get_state()],
+            [(recorder._ids[widget], pos)
+             for widget, pos in self.layout._get_state()])
+
+    def _replay(self, recorder, layout):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace')
+            recorder.save(path)
+            trace = TraceRecorder.load(path)
+        self.assertTrue(trace.replayable)
+        widgets = {}
+        replayed_layout, replayed = replay_trace(
+            trace, lambda widget_id: widgets.setdefault(widget_id,
+                                                       Widget(widget_id)))
+        self.assertEqual([op.error for op in replayed],
+                         [op.error for op in recorder.operations])
+        self.assertEqual(replayed_layout.max_span, layout.max_span)
+        self.assertCountEqual(
+            [(widget.name, pos)
+             for widget, pos in replayed_layout._get_state()],
+            [(recorder._ids[widget], pos)
+             for widget, pos in layout._get_state()])
+        return replayed_layout
+
+    def test_history_and_detach(self):
+        ws = [Widget(i) for i in range(3)]
+        layout = QTilingLayout(initial_widget=ws[0], max_span=4,
+                               undo_limit=5)
+        recorder = TraceRecorder(layout)
+        layout.hsplit(ws[0], ws[1])
+        layout.vsplit(ws[1], ws[2])
+        layout.undo()
+        layout.redo()
+        layout.undo()
+        layout.detach()
+        layout.remove_widget(ws[0])
+        layout.attach()
+        recorder.stop()
+        self.assertEqual([op.name for op in recorder.operations],
+                         ['hsplit', 'vsplit', 'undo', 'redo', 'undo',
+                          'detach', 'remove_widget', 'attach'])
+        self.assertTrue(recorder.replayable)
+        replayed_layout = self._replay(recorder, layout)
+        self.assertTrue(replayed_layout.can_undo())
+
+    def test_batch(self):
+        recorder = TraceRecorder(self.layout)
+        self.layout.maximize(self.ws[2])
+        with self.layout.batch():
+            self.layout.hsplit(self.ws[2], Widget('new'))
+            with self.layout.batch():
+                self.layout.remove_widget(self.ws[1])
+        with self.assertRaises(ZeroDivisionError):
+            with self.layout.batch():
+                self.layout.remove_widget(self.ws[3])
+                1 / 0
+        recorder.stop()
+        self.assertEqual([(op.name, op.result, op.error)
+                          for op in recorder.operations],
+                         [('maximize', None, None),
+                          ('restore', None, None),
+                          ('batch', 2, None),
+                          ('hsplit', {'w': 3}, None),
+                          ('remove_widget', None, None),
+                          ('batch', 0, 'ZeroDivisionError')])
+        self.assertTrue(recorder.replayable)
+        self._replay(recorder, self.layout)
+
+    def test_async(self):
+        recorder = TraceRecorder(self.layout)
+        futures = [self.layout.hsplit_async(self.ws[2],
+                                            lambda pos: Widget('new')),
+                   self.layout.vsplit_async(self.ws[3], Widget('new'))]
+        deadline = time.monotonic() + 5
+        while (not all(future.done() for future in futures)
+               and time.monotonic() < deadline):
+            self.app.processEvents()
+        recorder.stop()
+        self.assertEqual([(op.name, op.args, op.result, op.error)
+                          for op in recorder.operations],
+                         [('hsplit', [{'w': 2}, {'w': 3}], {'w': 3}, None),
+                          ('vsplit', [{'w': 1}, {'w': 4}], None,
+                           'SplitLimitException')])
+        self.assertTrue(recorder.replayable)
+        self._replay(recorder, self.layout)
+
+    def test_not_replayable(self):
+        ws = [Widget(i) for i in range(3)]
+        layout = QTilingLayout(initial_widget=ws[0], max_span=4,
+                               undo_limit=5)
+        layout.hsplit(ws[0], ws[1])
+        recorder = TraceRecorder(layout)
+        layout.vsplit(ws[1], ws[2])
+        self.assertTrue(recorder.replayable)
+        layout.undo()
+        self.assertFalse(recorder.replayable)
+        recorder.stop()
+
+        recorder = TraceRecorder(layout)
+        sip.delete(layout.hsplit(ws[0], lambda pos: Widget('new')))
+        self.assertFalse(layout.undo())
+        self.assertFalse(recorder.replayable)
+        recorder.stop()
+
+        self.layout.detach()
+        recorder = TraceRecorder(self.layout)
+        self.assertFalse(recorder.replayable)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace')
+            recorder.save(path)
+            self.assertFalse(TraceRecorder.load(path).replayable)
+
+
+class ComplexityTestCase(unittest.TestCase):
+    """Catches algorithmic regressions by counting calls to the grid.
+
+    Every scenario is run with growing values of max_span and the number of
+    calls to the QGridLayout methods, and to those of the TilingModels on
+    which operations are evaluated, must not grow faster than expected for
+    each scenario when max_span is doubled.
+    """
+
+    SPANS = (8, 16, 32)
+    # Calls that grow with max_span, or with the number of widgets of a column
+    LINEAR_GROWTH = 2.5
+    # Calls that grow with the number of cells, which doubling max_span
+    # multiplies by 4
+    CELLS_GROWTH = 4
+    COUNTED_METHODS = ('itemAtPosition', 'getItemPosition', 'indexOf',
+                       'addWidget', 'removeWidget')
+    COUNTED_MODEL_METHODS = ('_item_at_position', '_get_item_position',
+                             'addWidget', 'removeWidget')
+
+    def setUp(self):
+        self.app = QApplication([])
+
+    #  ┌──┬──┬──┬──┐
+    #  │  │  │  │  │
+    #  │  │  │  │  │
+    #  │  │  │  │  │
+    #  └──┴──┴──┴──┘
+    def _build_columns(self, span):
+        layout = QTilingLayout(max_span=span)
+        widgets = [Widget(i) for i in range(span // 2)]
+        for i, widget in enumerate(widgets):
+            layout.addWidget(widget, 0, 2 * i, span, 2)
+        return layout, widgets
+
+    #  ┌──┬──┬──┐
+    #  ├──┼──┼──┤
+    #  ├──┼──┼──┤
+    #  └──┴──┴──┘
+    def _build_grid(self, span):
+        layout = QTilingLayout(max_span=span)
+        widgets = []
+        for i in range(0, span, 2):
+            for j in range(0, span, 2):
+                widgets.append(Widget(len(widgets)))
+                layout.addWidget(widgets[-1], i, j, 2, 2)
+        return layout, widgets
+
+    def _assert_bounded(self, build, operation, max_growth):
+        counts = []
+        for span in self.SPANS:
+            layout, widgets = build(span)
+            layout.check_invariants = False
+            calls = record_calls(layout, *self.COUNTED_METHODS)
+
+            def get_model(get_model=layout._get_model, calls=calls):
+                model = get_model()
+                record_calls(model, *self.COUNTED_MODEL_METHODS, calls=calls)
+                return model
+            layout._get_model = get_model
+            operation(layout, widgets[len(widgets) // 2])
+            counts.append(len(calls))
+        for smaller, larger in zip(counts, counts[1:]):
+            self.assertLessEqual(larger, smaller * max_growth, counts)
+
+    def _hsplit(self, layout, widget):
+        layout.hsplit(widget, Widget('new'))
+
+    def _vsplit(self, layout, widget):
+        layout.vsplit(widget, Widget('new'))
+
+    def _remove(self, layout, widget):
+        layout.remove_widget(widget)
+
+    def test_columns_hsplit(self):
+        self._assert_bounded(self._build_columns, self._hsplit,
+                             self.LINEAR_GROWTH)
+
+    def test_columns_vsplit(self):
+        # Strict validation checks every cell of the columns it places again
+        self._assert_bounded(self._build_columns, self._vsplit,
+                             self.CELLS_GROWTH)
+
+    def test_columns_remove(self):
+        # Filling the gap visits every cell of the columns that are moved
+        self._assert_bounded(self._build_columns, self._remove,
+                             self.CELLS_GROWTH)
+
+    def test_grid_hsplit(self):
+        # Widgets of the same row or column as the split one are moved
+        self._assert_bounded(self._build_grid, self._hsplit, 3)
+
+    def test_grid_vsplit(self):
+        self._assert_bounded(self._build_grid, self._vsplit, 3)
+
+    def test_grid_remove(self):
+        # The grid has as many widgets as cells, up to a constant factor
+        self._assert_bounded(self._build_grid, self._remove,
+                             self.CELLS_GROWTH)
+
+    def test_remove_only_touches_moved_widgets(self):
+        for build in (self._build_columns, self._build_grid):
+            layout, widgets = build(16)
+            diffs = []
+            layout.layoutChanged.connect(diffs.append)
+            calls = record_calls(layout, 'addWidget', 'removeWidget')
+            layout.remove_widget(widgets[len(widgets) // 2])
+            self.assertEqual(len(calls), 2 * len(diffs[0].moved) + 1)
+            self.assertLess(len(diffs[0].moved), len(widgets) - 1)
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    #  ┌───┬───┐
+    #  │   │ 1 │
+    #  │ 0 ├───┤
+    #  │   │ 2 │
+    #  └───┴───┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingLayout(max_span=4)
+        self.layout.addWidget(self.ws[0], 0, 0, 4, 2)
+        self.layout.addWidget(self.ws[1], 0, 2, 2, 2)
+        self.layout.addWidget(self.ws[2], 2, 2, 2, 2)
+
+    def test_snapshot(self):
+        snapshot = self.layout.snapshot()
+        self.assertEqual(snapshot.max_span, 4)
+        self.assertEqual(snapshot.get_state(), [(1, (0, 0, 4, 2)),
+                                                (2, (0, 2, 2, 2)),
+                                                (3, (2, 2, 2, 2))])
+        self.assertEqual(snapshot, self.layout.snapshot())
+        self.assertEqual(hash(snapshot), hash(self.layout.snapshot()))
+
+    def test_stable_ids(self):
+        snapshot = self.layout.snapshot()
+        self.layout.remove_widget(self.ws[1])
+        self.layout.hsplit(self.ws[0], self.ws[3])
+        self.layout.hsplit(self.ws[2], self.ws[1])
+        ids = dict(self.layout.snapshot().get_state())
+        self.assertEqual(set(ids), {1, 2, 3, 4})
+        self.assertNotEqual(self.layout.snapshot(), snapshot)
+
+    def test_pickle(self):
+        snapshot = self.layout.snapshot()
+        self.assertEqual(pickle.loads(pickle.dumps(snapshot)), snapshot)
+
+    def test_model_round_trip(self):
+        snapshot = self.layout.snapshot()
+        model = TilingModel.from_snapshot(pickle.loads(pickle.dumps(snapshot)))
+        model.remove_widget(2)
+        expected = self.layout.copy()
+        expected.remove_widget(self.ws[1])
+        self.layout.apply_snapshot(model.snapshot())
+        self.assertCountEqual(self.layout._get_state(), expected._get_state())
+
+    def test_unknown_id(self):
+        snapshot = LayoutSnapshot.from_state(4, [(9, (0, 0, 4, 4))])
+        with self.assertRaises(WidgetNotInLayoutException):
+            self.layout.apply_snapshot(snapshot)
+
+    def test_invalid_tiling(self):
+        state = self.layout._get_state()
+        ids = [self.layout._get_widget_id(widget) for widget, _ in state]
+        for items, exception in (
+                ([(ids[0], (0, 0, 4, 2)), (ids[1], (0, 2, 4, 2)),
+                  (ids[2], (2, 2, 2, 2))], WidgetOverlapException),
+                ([(ids[0], (0, 0, 4, 2)), (ids[1], (0, 2, 2, 2))],
+                 EmptySpaceInLayoutException),
+                ([(ids[0], (0, 0, 4, 2)), (ids[1], (0, 2, 2, 2)),
+                  (ids[2], (2, 2, 2, 4))], WidgetOverlapException),
+                ([(ids[0], (0, 0, 4, 2)), (ids[1], (0, 2, 2, 2)),
+                  (ids[1], (2, 2, 2, 2))], EmptySpaceInLayoutException)):
+            with self.assertRaises(exception):
+                self.layout.apply_snapshot(
+                    LayoutSnapshot.from_state(4, items))
+            self.assertEqual(self.layout._get_state(), state)
+
+
+class HitTestingTestCase(unittest.TestCase):
+
+    #  ┌───┬───────┐
+    #  │ 0 │   1   │
+    #  ├───┴───┬───┤
+    #  │       │   │
+    #  │   2   │ 3 │
+    #  │       │   │
+    #  └───────┴───┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.parent = QWidget()
+        self.ws = [Widget(i) for i in range(5)]
+        self.layout = QTilingGeometryLayout(self.parent, max_span=4)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.setSpacing(2)
+        self.layout.addWidget(self.ws[0], 0, 0, 1, 1)
+        self.layout.addWidget(self.ws[1], 0, 1, 1, 3)
+        self.layout.addWidget(self.ws[2], 1, 0, 3, 3)
+        self.layout.addWidget(self.ws[3], 1, 3, 3, 1)
+        self.layout.setGeometry(QRect(0, 0, 82, 42))
+
+    def test_widget_at(self):
+        self.assertIs(self.layout.widget_at(QPoint(0, 0)), self.ws[0])
+        self.assertIs(self.layout.widget_at(QPoint(50, 5)), self.ws[1])
+        self.assertIs(self.layout.widget_at(QPoint(25, 11)), self.ws[2])
+        self.assertIs(self.layout.widget_at(QPoint(80, 40)), self.ws[3])
+
+    def test_outside_widgets(self):
+        self.assertIsNone(self.layout.widget_at(QPoint(-1, 5)))
+        self.assertIsNone(self.layout.widget_at(QPoint(5, 100)))
+        # Spacing between 0 and 1
+        self.assertIsNone(self.layout.widget_at(QPoint(19, 5)))
+
+    def test_widgets_in_rect(self):
+        self.assertCountEqual(self.layout.widgets_in_rect(QRect(0, 0, 5, 5)),
+                              [self.ws[0]])
+        self.assertCountEqual(
+            self.layout.widgets_in_rect(QRect(10, 5, 40, 10)),
+            [self.ws[0], self.ws[1], self.ws[2]])
+        self.assertCountEqual(
+            self.layout.widgets_in_rect(QRect(-10, -10, 200, 200)),
+            self.ws[:4])
+        self.assertEqual(self.layout.widgets_in_rect(QRect(19, 0, 1, 5)), [])
+
+    def test_updated_after_operations(self):
+        self.layout.vsplit(self.ws[0], self.ws[4])
+        self.layout.setGeometry(QRect(0, 0, 82, 42))
+        self.assertIs(self.layout.widget_at(QPoint(50, 5)), self.ws[4])
+        self.layout.remove_widget(self.ws[3])
+        self.layout.setGeometry(QRect(0, 0, 82, 42))
+        self.assertIs(self.layout.widget_at(QPoint(80, 40)), self.ws[2])
+
+    def test_updated_after_resize(self):
+        self.layout.setGeometry(QRect(0, 0, 162, 82))
+        self.assertIs(self.layout.widget_at(QPoint(30, 5)), self.ws[0])
+        self.assertIs(self.layout.widget_at(QPoint(100, 30)), self.ws[2])
+
+
+class PreviewTestCase(unittest.TestCase):
+
+    #  ┌───┬───┐
+    #  │   │ 1 │
+    #  │ 0 ├───┤
+    #  │   │ 2 │
+    #  └───┴───┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.parent = QWidget()
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingGeometryLayout(self.parent, max_span=2)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.layout.setSpacing(0)
+        self.layout.addWidget(self.ws[0], 0, 0, 2, 1)
+        self.layout.addWidget(self.ws[1], 0, 1, 1, 1)
+        self.layout.addWidget(self.ws[2], 1, 1, 1, 1)
+        self.state = self.layout._get_state()
+
+    def test_split(self):
+        diff = self.layout.preview('hsplit', self.ws[0])
+        self.assertEqual(diff, LayoutDiff([(None, (1, 0, 1, 1))], [],
+                                          [(self.ws[0], (0, 0, 2, 1),
+                                            (0, 0, 1, 1))]))
+        self.assertEqual(self.layout._get_state(), self.state)
+
+    def test_impossible(self):
+        self.assertIsNone(self.layout.preview('vsplit', self.ws[1]))
+
+    def test_move_widget(self):
+        diff = self.layout.preview('move_widget', self.ws[2], self.ws[0],
+                                   'bottom')
+        self.layout.move_widget(self.ws[2], self.ws[0], 'bottom')
+        self.assertEqual(diff, LayoutDiff.between(self.state,
+                                                  self.layout._get_state()))
+
+    def test_cache(self):
+        calls = []
+        get_model = self.layout._get_model
+        self.layout._get_model = lambda: calls.append(None) or get_model()
+        first = self.layout.preview('move_widget', self.ws[2], self.ws[0],
+                                    'top')
+        second = self.layout.preview('move_widget', self.ws[2], self.ws[0],
+                                     'top')
+        self.assertIs(first, second)
+        self.assertEqual(len(calls), 1)
+        self.layout.swap_widgets(self.ws[1], self.ws[2])
+        self.layout.preview('move_widget', self.ws[2], self.ws[0], 'top')
+        self.assertEqual(len(calls), 2)
+
+    def test_invalid_operation(self):
+        with self.assertRaises(ValueError):
+            self.layout.preview('equalize')
+
+    def test_position_rect(self):
+        self.layout.setGeometry(QRect(0, 0, 100, 60))
+        diff = self.layout.preview('hsplit', self.ws[0], True)
+        self.assertEqual(self.layout.position_rect(diff.added[0][1]),
+                         QRect(0, 0, 50, 30))
+        self.assertEqual(self.layout.position_rect((0, 0, 2, 2)),
+                         QRect(0, 0, 100, 60))
+        self.assertEqual(self.layout.position_rect((1, 1, 2, 2), 4),
+                         QRect(25, 15, 50, 30))
+        self.assertEqual(self.layout.position_rect((0, 0, 1, 1), 1),
+                         QRect(0, 0, 100, 60))
+
+
+class UndoTestCase(unittest.TestCase):
+
+    #  ┌───┬───┐
+    #  │ 0 │ 1 │
+    #  └───┴───┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(4)]
+        self.layout = QTilingLayout(max_span=4, undo_limit=3)
+        self.layout.addWidget(self.ws[0], 0, 0, 4, 2)
+        self.layout.addWidget(self.ws[1], 0, 2, 4, 2)
+        self.diffs = []
+        self.layout.layoutChanged.connect(self.diffs.append)
+
+    def test_undo_redo(self):
+        states = [self.layout._get_state()]
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        states.append(self.layout._get_state())
+        self.layout.remove_widget(self.ws[1])
+        states.append(self.layout._get_state())
+        self.assertTrue(self.layout.undo())
+        self.assertCountEqual(self.layout._get_state(), states[1])
+        self.assertTrue(self.layout.undo())
+        self.assertCountEqual(self.layout._get_state(), states[0])
+        self.assertFalse(self.layout.undo())
+        self.assertTrue(self.layout.redo())
+        self.assertTrue(self.layout.redo())
+        self.assertCountEqual(self.layout._get_state(), states[2])
+        self.assertFalse(self.layout.redo())
+        self.assertEqual(self.diffs[2], self.diffs[1].inverted())
+        self.assertEqual(self.diffs[5], self.diffs[1])
+
+    def test_only_diff_applied(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        calls = []
+        add_widget = self.layout.addWidget
+        self.layout.addWidget = lambda *args: (calls.append(args[0]),
+                                               add_widget(*args))
+        self.layout.undo()
+        self.assertEqual(calls, [self.ws[0]])
+
+    def test_new_operation_clears_redo(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.undo()
+        self.assertTrue(self.layout.can_redo())
+        self.layout.vsplit(self.ws[0], self.ws[2])
+        self.assertFalse(self.layout.can_redo())
+
+    def test_limit(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.hsplit(self.ws[1], self.ws[3])
+        self.layout.swap_widgets(self.ws[0], self.ws[1])
+        self.layout.swap_widgets(self.ws[2], self.ws[3])
+        for _ in range(3):
+            self.assertTrue(self.layout.undo())
+        self.assertFalse(self.layout.can_undo())
+        self.assertEqual(self.layout.count(), 3)
+
+    def test_removed_widget_not_kept(self):
+        widget = Widget('new')
+        self.layout.hsplit(self.ws[0], widget)
+        self.layout.remove_widget(widget)
+        widget_ref = weakref.ref(widget)
+        del widget
+        self.diffs.clear()
+        gc.collect()
+        self.assertIsNone(widget_ref())
+        self.assertFalse(self.layout.undo())
+        self.assertFalse(self.layout.can_undo())
+        self.assertEqual(self.layout.count(), 2)
+
+    def test_size_limit(self):
+        # Each split adds a widget and moves the split one
+        self.layout.HISTORY_SIZE = 4
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.hsplit(self.ws[1], self.ws[3])
+        self.assertEqual(len(self.layout._undo_stack), 2)
+        self.layout.vsplit(self.ws[2], Widget('new'))
+        self.assertEqual(len(self.layout._undo_stack), 2)
+        self.assertTrue(self.layout.undo())
+        self.assertTrue(self.layout.undo())
+        self.assertFalse(self.layout.undo())
+        self.assertEqual(self.layout.count(), 3)
+
+    def test_changes_while_detached(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        split_state = self.layout._get_state()
+        self.layout.detach()
+        self.layout.vsplit(self.ws[2], self.ws[3])
+        self.layout.remove_widget(self.ws[0])
+        self.layout.attach()
+        state = self.layout._get_state()
+        self.assertTrue(self.layout.undo())
+        self.assertCountEqual(self.layout._get_state(), split_state)
+        self.layout._verify_tiling()
+        self.assertTrue(self.layout.redo())
+        self.assertCountEqual(self.layout._get_state(), state)
+        self.assertTrue(self.layout.undo())
+        self.assertTrue(self.layout.undo())
+        self.assertEqual(self.layout.count(), 2)
+
+    def test_grid_changed_outside_history(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        state = self.layout._get_state()
+        position = self.layout._get_item_position(self.ws[2], False)
+        self.layout.removeWidget(self.ws[2])
+        self.layout.addWidget(self.ws[3], *position)
+        self.assertFalse(self.layout.undo())
+        self.assertFalse(self.layout.can_undo())
+        self.assertEqual(self.layout.count(), 3)
+        self.assertNotEqual(self.layout._get_state(), state)
+
+    def test_maximize_not_recorded(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.maximize(self.ws[2])
+        self.layout.undo()
+        self.assertFalse(self.layout.is_maximized())
+        self.assertEqual(self.layout.count(), 2)
+
+    def test_deleted_widget(self):
+        self.layout.hsplit(self.ws[0], self.ws[2])
+        self.layout.remove_widget(self.ws[2])
+        sip.delete(self.ws[2])
+        self.assertFalse(self.layout.undo())
+        self.assertFalse(self.layout.can_undo())
+
+    def test_disabled(self):
+        layout = QTilingLayout(initial_widget=Widget('new'))
+        layout.hsplit(layout.itemAt(0).widget(), self.ws[0])
+        self.assertFalse(layout.undo())
+        self.assertEqual(layout.count(), 2)
+
+    def test_adaptive(self):
+        layout = QTilingLayout(max_span=1, adaptive=True, undo_limit=10)
+        layout.addWidget(self.ws[0], 0, 0, 1, 1)
+        layout.hsplit(self.ws[0], self.ws[1])
+        self.assertEqual(layout.max_span, 2)
+        while layout.undo():
+            pass
+        self.assertEqual(layout.max_span, 1)
+        self.assertEqual(layout._get_state(), [(self.ws[0], (0, 0, 1, 1))])
+
+    def test_adaptive_operation_is_one_entry(self):
+        layout = QTilingLayout(max_span=2, adaptive=True, undo_limit=10)
+        layout.addWidget(self.ws[0], 0, 0, 1, 2)
+        layout.addWidget(self.ws[1], 1, 0, 1, 2)
+        diffs = []
+        layout.layoutChanged.connect(diffs.append)
+        state = layout._get_state()
+        layout.hsplit(self.ws[0], self.ws[2])
+        self.assertEqual(layout.max_span, 4)
+        split_state = layout._get_state()
+        self.assertEqual(len(diffs), 1)
+        layout.remove_widget(self.ws[2])
+        self.assertEqual(layout.max_span, 2)
+        self.assertEqual(len(diffs), 2)
+        self.assertTrue(layout.undo())
+        self.assertEqual(layout.max_span, 4)
+        self.assertCountEqual(layout._get_state(), split_state)
+        self.assertTrue(layout.undo())
+        self.assertEqual(layout.max_span, 2)
+        self.assertCountEqual(layout._get_state(), state)
+        self.assertFalse(layout.can_undo())
+
+
+class RemoveWidgetsTestCase(unittest.TestCase):
+
+    #  ┌───┬───┬───┐
+    #  │ 0 │ 1 │ 2 │
+    #  ├───┴───┼───┤
+    #  │   3   │ 4 │
+    #  └───────┴───┘
+    def setUp(self):
+        self.app = QApplication([])
+        self.ws = [Widget(i) for i in range(5)]
+        self.layout = QTilingLayout(max_span=6)
+        self.layout.addWidget(self.ws[0], 0, 0, 3, 2)
+        self.layout.addWidget(self.ws[1], 0, 2, 3, 2)
+        self.layout.addWidget(self.ws[2], 0, 4, 3, 2)
+        self.layout.addWidget(self.ws[3], 3, 0, 3, 4)
+        self.layout.addWidget(self.ws[4], 3, 4, 3, 2)
+        self.diffs = []
+        self.layout.layoutChanged.connect(self.diffs.append)
+
+    def test_remove_widgets(self):
+        self.layout.remove_widgets([self.ws[1], self.ws[4]])
+        self.assertEqual(self.layout.count(), 3)
+        self.assertEqual(self.layout.indexOf(self.ws[1]), -1)
+        self.assertEqual(self.layout.indexOf(self.ws[4]), -1)
+        self.assertTrue(self.ws[1].isHidden())
+        self.layout._verify_tiling()
+        self.assertEqual(len(self.diffs), 1)
+        self.assertCountEqual([w for w, _ in self.diffs[0].removed],
+                              [self.ws[1], self.ws[4]])
+
+    def _count_rearrangements(self, operation):
+        calls = []
+        rearrange_widgets = TilingModel._rearrange_widgets
+
+        def counter(model, widgets, domain):
+            calls.append(domain)
+            return rearrange_widgets(model, widgets, domain)
+        TilingModel._rearrange_widgets = counter
+        try:
+            with self.layout.batch():
+                operation()
+        finally:
+            TilingModel._rearrange_widgets = rearrange_widgets
+        return len(calls)
+
+    def test_rearranges_once(self):
+        state = self.layout._get_state()
+        sequential = self._count_rearrangements(
+            lambda: [self.layout.remove_widget(w) for w in self.ws[:3]])
+        self.layout._restore_state(state)
+        bulk = self._count_rearrangements(
+            lambda: self.layout.remove_widgets(self.ws[:3]))
+        # One rearrangement per widget plus a whole layout pass per direction
+        self.assertEqual(sequential, 6)
+        self.assertLessEqual(bulk, 5)
+        self.layout._verify_tiling()
+
+    def test_remove_all(self):
+        self.layout.remove_widgets(self.ws)
+        self.assertEqual(self.layout.count(), 0)
+
+    def test_unknown_widget(self):
+        state = self.layout._get_state()
+        with self.assertRaises(SplitException) as cm:
+            self.layout.remove_widgets([self.ws[0], Widget('new')])
+        self.assertIsInstance(cm.exception.__cause__,
+                              WidgetNotInLayoutException)
+        self.assertEqual(cm.exception.operation, 'remove')
+        self.assertEqual(self.layout._get_state(), state)
+        self.assertEqual(self.diffs, [])
+
+    def test_unknown_widget_after_last(self):
+        layout = QTilingLayout(max_span=2)
+        layout.addWidget(self.ws[0], 0, 0, 2, 1)
+        layout.addWidget(self.ws[1], 0, 1, 2, 1)
+        state = layout._get_state()
+        widgets = [self.ws[0], self.ws[1], Widget('new')]
+        with self.assertRaises(SplitException):
+            layout.remove_widgets(widgets)
+        self.assertEqual(layout._get_state(), state)
+        with self.assertRaises(SplitException):
+            with layout.batch():
+                layout.remove_widgets(widgets)
+        self.assertEqual(layout._get_state(), state)
+
+    def test_duplicates(self):
+        self.layout.remove_widgets([self.ws[0], self.ws[0]])
+        self.assertEqual(self.layout.count(), 4)
+
+
 if __name__ == '__main__':
     unittest.main()
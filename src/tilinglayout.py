@@ -1,4 +1,15 @@
-from PyQt5.QtWidgets import QGridLayout
+import json
+from bisect import bisect_left, bisect_right, insort
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from time import perf_counter
+from weakref import WeakKeyDictionary, WeakValueDictionary, ref
+
+from PyQt5 import sip
+from PyQt5.QtCore import QRect, QSize, Qt, pyqtSignal
+from PyQt5.QtWidgets import QGridLayout, QLayout, QWidgetItem
 
 
 class SplitLimitException(Exception):
@@ -17,8 +28,31 @@ class WidgetNotInLayoutException(Exception):
     pass
 
 
+class EmptySpaceInLayoutException(Exception):
+    pass
+
+
+class InconsistentGridException(Exception):
+    pass
+
+
+def _pack_position(pos):
+    """Packs a (row, col, rowspan, colspan) tuple into a single integer."""
+    return pos[0] | pos[1] << 16 | pos[2] << 32 | pos[3] << 48
+
+
+def _unpack_position(packed):
+    """Inverse of _pack_position."""
+    return (packed & 0xffff, packed >> 16 & 0xffff, packed >> 32 & 0xffff,
+            packed >> 48 & 0xffff)
+
+
 class SplitException(Exception):
-    """Generic unexpected exception with useful debug information"""
+    """Generic unexpected exception with useful debug information
+
+    Only a compact snapshot of the state is kept when the exception is
+    created. The message and the positions are rendered when accessed.
+    """
 
     def __init__(self, state, widget, operation):
         """Creates a new SplitException
@@ -33,160 +67,150 @@ class SplitException(Exception):
         if operation not in valid_operations:
             raise ValueError('"operation" must be one of '
                              '{}'.format(valid_operations))
-        pos = None
-        positions = []
-        for tmp_widget, tmp_pos in state:
-            positions.append(tmp_pos)
+        super().__init__()
+        widget_index = None
+        packed_positions = []
+        for index, (tmp_widget, tmp_pos) in enumerate(state):
+            packed_positions.append(_pack_position(tmp_pos))
             if tmp_widget is widget:
-                pos = tmp_pos
-
-        super().__init__('Exception raised when performing a "{}" operation '
-                         'of the widget positioned at {}.\nPositions:\n'
-                         '{}'.format(operation, pos,
-                                     '\n'.join(str(p) for p in positions)))
-        self.positions = positions
-        self.widget_pos = pos
+                widget_index = index
+        self._packed_positions = tuple(packed_positions)
+        self._widget_index = widget_index
         self.operation = operation
 
+    @property
+    def positions(self):
+        return [_unpack_position(p) for p in self._packed_positions]
 
-class QTilingLayout(QGridLayout):
+    @property
+    def widget_pos(self):
+        if self._widget_index is None:
+            return None
+        return _unpack_position(self._packed_positions[self._widget_index])
 
-    def __init__(self, *args, initial_widget=None, max_span=12, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.max_span = max_span
-        if initial_widget:
-            self.addWidget(initial_widget, 0, 0, self.max_span, self.max_span)
+    def __str__(self):
+        return ('Exception raised when performing a "{}" operation of the '
+                'widget positioned at {}.\nPositions:\n'
+                '{}'.format(self.operation, self.widget_pos,
+                            '\n'.join(str(p) for p in self.positions)))
 
-    def _is_point_inside_grid(self, row, col):
-        """Determines if the point is inside the layout."""
-        return 0 <= row < self.max_span and 0 <= col < self.max_span
 
-    def _add_widget(self, widget, row, col, rowspan, colspan, transpose):
-        """Invokes QGridLayout.addWidget on a possibly transposed grid.
+class LayoutDiff(namedtuple('LayoutDiff', ['added', 'removed', 'moved'])):
+    """The changes made to a layout by an operation.
 
-        Args:
-            widget: Same as in QGridLayout.addWidget.
-            row: Same as in QGridLayout.addWidget.
-            col: Same as in QGridLayout.addWidget.
-            rowspan: Same as in QGridLayout.addWidget.
-            colspan: Same as in QGridLayout.addWidget.
-            transpose: If True, will behave as if the grid was transposed.
-        """
-        try:
-            EmptyBlock(self, transpose, row, col, rowspan, colspan)
-        except (WidgetInEmptyBlockException, InvalidBlockException):
-            raise WidgetOverlapException from None
+    Attributes:
+        added: A list of (widget, position) tuples.
+        removed: A list of (widget, position) tuples with the position the
+                 widget had before being removed.
+        moved: A list of (widget, old_position, new_position) tuples.
+    """
 
-        if not transpose:
-            return self.addWidget(widget, row, col, rowspan, colspan)
-        else:
-            return self.addWidget(widget, col, row, colspan, rowspan)
+    __slots__ = ()
 
-    def _get_item_position(self, widget, transpose):
-        """Invokes QGridLayout.getItemPosition on a possibly transposed grid.
+    @classmethod
+    def between(cls, old_state, new_state):
+        """Builds the diff between two lists as returned by _get_state."""
+        old_positions = dict(old_state)
+        new_positions = dict(new_state)
+        added = [(widget, pos) for widget, pos in new_state
+                 if widget not in old_positions]
+        removed = [(widget, pos) for widget, pos in old_state
+                   if widget not in new_positions]
+        moved = [(widget, old_positions[widget], pos)
+                 for widget, pos in new_state
+                 if widget in old_positions and old_positions[widget] != pos]
+        return cls(added, removed, moved)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved)
+
+    def inverted(self):
+        """Returns the diff that undoes this one."""
+        return LayoutDiff(self.removed, self.added,
+                          [(widget, new_pos, old_pos)
+                           for widget, old_pos, new_pos in self.moved])
+
+
+class LayoutSnapshot(namedtuple('LayoutSnapshot', ['max_span', 'items'])):
+    """An immutable state of a layout that can be hashed and pickled.
+
+    Widgets are identified by integers, so snapshots can be sent to other
+    processes or used as cache keys.
+
+    Attributes:
+        max_span: The number of rows and columns of the grid.
+        items: A tuple of (id, packed_position) tuples sorted by id, where
+               every position is packed with _pack_position.
+    """
+
+    __slots__ = ()
 
-        Args:
-            widget: The widget whose position will be returned.
-            transpose: If True, will behave as if the grid was transposed.
-        """
-        index = self.indexOf(widget)
-        if index < 0:
-            raise WidgetNotInLayoutException(
-                    'QGridLayout.indexOf(widget) returned -1')
-        else:
-            pos = self.getItemPosition(index)
-            return pos if not transpose else (pos[1], pos[0], pos[3], pos[2])
+    @classmethod
+    def from_state(cls, max_span, state):
+        """Builds a snapshot from a list of (id, position) tuples."""
+        return cls(max_span, tuple(sorted(
+            (widget_id, _pack_position(pos)) for widget_id, pos in state)))
 
-    def _item_at_position(self, row, col, transpose):
-        """Invokes QGridLayout.itemAtPosition on a possibly transposed grid.
+    def get_state(self):
+        """Returns the list of (id, position) tuples of the snapshot."""
+        return [(widget_id, _unpack_position(packed))
+                for widget_id, packed in self.items]
 
-        Args:
-            row: Same as in QGridLayout.itemAtPosition.
-            col: Same as in QGridLayout.itemAtPosition.
-            transpose: If True, will behave as if the grid was transposed.
-        """
-        if not self._is_point_inside_grid(row, col):
-            raise PointOutsideGridException
 
-        if not transpose:
-            return self.itemAtPosition(row, col)
-        else:
-            return self.itemAtPosition(col, row)
+# An operation in the undo history of a layout, with the max_span the layout
+# had before and after it. The diff is built by _weak_diff.
+_HistoryEntry = namedtuple('_HistoryEntry', ['diff', 'old_span', 'new_span'])
 
-    def _get_state(self):
-        """Returns every widget in the layout along with its position"""
-        return [(self.itemAt(i).widget(), self.getItemPosition(i))
-                for i in range(self.count())]
 
-    def _restore_state(self, prev_state):
-        item = self.itemAt(0)
-        while item:
-            widget = item.widget()
-            self.removeWidget(widget)
-            widget.hide()
-            item = self.itemAt(0)
-        for widget, pos in prev_state:
-            widget.show()
-            self.addWidget(widget, *pos)
+def _weak_diff(diff):
+    """Returns a copy of a LayoutDiff that refers to its widgets weakly.
 
-    def remove_widget(self, widget):
-        """Removes a widget from the layout and fills the remaining space"""
-        if self.count() == 1:
-            self.removeWidget(widget)
-        else:
-            original_state = self._get_state()
-            try:
-                widget_pos = self._get_item_position(widget, False)
-                transpose = widget_pos[3] < widget_pos[2]
-                ib = self._get_independent_block(widget, transpose)
-                self.removeWidget(widget)
-                widget.hide()
-                widgets = list(ib.get_widgets())
-                self._rearrange_widgets(widgets, ib)
-                # Rearrange widgets in the opposite direction as the resizing
-                # results in some widgets sharing the space better with their
-                # neighbours
-                whole_block = CriticalBlock(self, not transpose, 0, 0,
-                                            self.max_span, self.max_span)
-                self._rearrange_widgets(list(whole_block.get_widgets()),
-                                        whole_block)
-            except Exception as e:
-                raise SplitException(original_state, widget, 'remove') from e
+    This way the history doesn't keep alive the widgets that were removed.
+    """
+    return LayoutDiff([(ref(widget), pos) for widget, pos in diff.added],
+                      [(ref(widget), pos) for widget, pos in diff.removed],
+                      [(ref(widget), old_pos, new_pos)
+                       for widget, old_pos, new_pos in diff.moved])
 
-    def hsplit(self, old_widget, new_widget, put_before=False):
-        """Splits the specified widget horizontally.
 
-        Args:
-            old_widget: The widget to split.
-            new_widget: The widget to insert in the new space.
-            put_before: If True, the new widget will be inserted on top of the
-                        old widget.
-        """
+def _strong_diff(diff):
+    """Reverses _weak_diff.
 
-        self._split(old_widget, new_widget, put_before, False)
+    Returns:
+        The LayoutDiff, or None if any of its widgets has been destroyed.
+    """
+    diff = LayoutDiff([(r(), pos) for r, pos in diff.added],
+                      [(r(), pos) for r, pos in diff.removed],
+                      [(r(), old_pos, new_pos)
+                       for r, old_pos, new_pos in diff.moved])
+    if any(widget is None or sip.isdeleted(widget)
+           for widget, *_ in diff.added + diff.removed + diff.moved):
+        return None
+    return diff
 
-    def vsplit(self, old_widget, new_widget, put_before=False):
-        """Splits the specified widget vertically.
 
-        Args:
-            old_widget: The widget to split.
-            new_widget: The widget to insert in the new space.
-            put_before: If True, the new widget will be inserted to the left of
-                        the old widget.
-        """
-        self._split(old_widget, new_widget, put_before, True)
+def _recorded(method):
+    """Makes a public method of _TilingLayout visible to its recorder."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.recorder is None:
+            return method(self, *args, **kwargs)
+        return self.recorder._record(
+            method.__name__, args, kwargs,
+            lambda: method(self, *args, **kwargs))
+    return wrapper
 
-    def get_left_neighbour(self, widget):
-        return self._get_neighbour(widget, True, False)
 
-    def get_top_neighbour(self, widget):
-        return self._get_neighbour(widget, True, True)
+class _TilingAlgorithm:
+    """The tiling operations shared by QTilingLayout and TilingModel.
 
-    def get_right_neighbour(self, widget):
-        return self._get_neighbour(widget, False, False)
+    Subclasses must provide max_span, count, removeWidget, _add_widget,
+    _get_item_position, _item_at_position and _get_state.
+    """
 
-    def get_bottom_neighbour(self, widget):
-        return self._get_neighbour(widget, False, True)
+    def _is_point_inside_grid(self, row, col):
+        """Determines if the point is inside the layout."""
+        return 0 <= row < self.max_span and 0 <= col < self.max_span
 
     def _get_neighbour(self, widget, left, transpose):
         """Returns the neighbour widget in the requested direction.
@@ -223,9 +247,43 @@ class QTilingLayout(QGridLayout):
         except PointOutsideGridException:
             return None
 
+    def _verify_tiling(self):
+        """Checks the invariants of the tiling in a single pass.
 
-    def _split(self, old_widget, new_widget, put_before, transpose):
-        """Splits the specified widget.
+        The cells covered by the widgets are accumulated in one bitset per
+        row, so every widget is checked with a mask per row it spans instead
+        of querying each of its cells.
+
+        Raises:
+            WidgetOverlapException: If two widgets share a cell or a widget
+                                    exceeds the limits of the grid.
+            EmptySpaceInLayoutException: If a cell is not covered by any
+                                         widget.
+            InconsistentGridException: If the cell lookup of the grid
+                                       doesn't match the widget positions.
+        """
+        state = self._get_state()
+        rows = [0] * self.max_span
+        for widget, (row, col, rowspan, colspan) in state:
+            if not (row >= 0 and col >= 0 and rowspan > 0 and colspan > 0
+                    and row + rowspan <= self.max_span
+                    and col + colspan <= self.max_span):
+                raise WidgetOverlapException
+            mask = ((1 << colspan) - 1) << col
+            for i in range(row, row + rowspan):
+                if rows[i] & mask:
+                    raise WidgetOverlapException
+                rows[i] |= mask
+        full = (1 << self.max_span) - 1
+        if any(row != full for row in rows):
+            raise EmptySpaceInLayoutException
+        for widget, (row, col, _, _) in state:
+            item = self._item_at_position(row, col, False)
+            if item is None or item.widget() is not widget:
+                raise InconsistentGridException
+
+    def _split_widgets(self, old_widget, new_widget, put_before, transpose):
+        """Inserts new_widget next to old_widget and rearranges the grid.
 
         Args:
             old_widget: The widget to split.
@@ -234,26 +292,173 @@ class QTilingLayout(QGridLayout):
                         old widget.
             transpose: If True, will behave as if the grid was transposed.
         """
-        original_state = self._get_state()
-        try:
-            old_widget_pos = self._get_item_position(old_widget, transpose)
-            ib = self._get_independent_block(old_widget, transpose)
-            widgets = list(ib.get_widgets())
+        old_widget_pos = self._get_item_position(old_widget, transpose)
+        ib = self._get_independent_block(old_widget, transpose)
+        widgets = list(ib.get_widgets())
+        for widget, _ in widgets:
+            self.removeWidget(widget)
+        if put_before:
+            widgets.insert(widgets.index((old_widget, old_widget_pos)),
+                           (new_widget, old_widget_pos))
+        else:
+            widgets.insert(widgets.index((old_widget, old_widget_pos)) + 1,
+                           (new_widget, old_widget_pos))
+        self._rearrange_widgets(widgets, ib)
+
+    def _remove_widget(self, widget):
+        """Takes the widget out of the grid and fills the remaining space."""
+        widget_pos = self._get_item_position(widget, False)
+        transpose = widget_pos[3] < widget_pos[2]
+        ib = self._get_independent_block(widget, transpose)
+        self.removeWidget(widget)
+        widgets = list(ib.get_widgets())
+        self._rearrange_widgets(widgets, ib)
+        # Rearrange widgets in the opposite direction as the resizing
+        # results in some widgets sharing the space better with their
+        # neighbours
+        whole_block = CriticalBlock(self, not transpose, 0, 0,
+                                    self.max_span, self.max_span)
+        self._rearrange_widgets(list(whole_block.get_widgets()),
+                                whole_block)
+
+    def _remove_widgets(self, widgets):
+        """Removes several widgets rearranging the whole layout only once.
+
+        Every widget is taken out and its independent block is rearranged
+        like in _remove_widget, but the pass over the whole layout in the
+        opposite direction is done at the end, once per direction needed.
+        Every widget is checked before anything is removed.
+        """
+        for widget in widgets:
+            self._get_item_position(widget, False)
+        transposes = []
+        for widget in widgets:
+            widget_pos = self._get_item_position(widget, False)
+            if self.count() == 1:
+                self.removeWidget(widget)
+                return
+            transpose = widget_pos[3] < widget_pos[2]
+            ib = self._get_independent_block(widget, transpose)
+            self.removeWidget(widget)
+            self._rearrange_widgets(list(ib.get_widgets()), ib)
+            if transpose not in transposes:
+                transposes.append(transpose)
+        for transpose in transposes:
+            whole_block = CriticalBlock(self, not transpose, 0, 0,
+                                        self.max_span, self.max_span)
+            self._rearrange_widgets(list(whole_block.get_widgets()),
+                                    whole_block)
+
+    def _swap_widgets(self, widget_a, widget_b):
+        """Exchanges the positions of two widgets."""
+        pos_a = self._get_item_position(widget_a, False)
+        pos_b = self._get_item_position(widget_b, False)
+        if widget_a is widget_b:
+            return
+        self.removeWidget(widget_a)
+        self.removeWidget(widget_b)
+        self._add_widget(widget_a, *pos_b, False)
+        self._add_widget(widget_b, *pos_a, False)
+
+    def _move_widget(self, widget, target, side):
+        """Removes a widget and inserts it next to target.
+
+        Args:
+            widget: The widget to move.
+            target: The widget that will be split to make room for widget.
+            side: 'left', 'top', 'right' or 'bottom'.
+        """
+        if widget is target:
+            raise ValueError('A widget cannot be moved next to itself')
+        self._get_item_position(target, False)
+        self._remove_widget(widget)
+        self._split_widgets(target, widget, side in ('left', 'top'),
+                            side in ('left', 'right'))
+
+    def _equalize(self, transposes):
+        """Gives the same width to every widget that shares a row.
+
+        The layout is recursively cut along the lines that don't cross any
+        widget, and the width of each region is distributed among its parts
+        in proportion to the number of widgets they have side by side.
+        Regions that cannot be cut keep their size.
+
+        Args:
+            transposes: An iterable of booleans. The widths are equalized on
+                        the grid transposed as indicated by each of them.
+        """
+        for transpose in transposes:
+            state = [(widget, self._get_item_position(widget, transpose))
+                     for widget, _ in self._get_state()]
+            root = _CutNode.build(state, 0, 0, self.max_span, self.max_span)
+            columns = {}
+            root.assign(0, self.max_span, columns)
+            widgets = [(widget, (pos[0], columns[widget][0], pos[2],
+                                 columns[widget][1]))
+                       for widget, pos in state
+                       if columns[widget] != (pos[1], pos[3])]
             for widget, _ in widgets:
                 self.removeWidget(widget)
-            if put_before:
-                widgets.insert(widgets.index((old_widget, old_widget_pos)),
-                               (new_widget, old_widget_pos))
-            else:
-                widgets.insert(widgets.index((old_widget, old_widget_pos)) + 1,
-                               (new_widget, old_widget_pos))
-            self._rearrange_widgets(widgets, ib)
-        except SplitLimitException:
-            self._restore_state(original_state)
-            raise
-        except Exception as e:
-            raise SplitException(original_state, old_widget,
-                                 'vsplit' if transpose else 'hsplit') from e
+            for widget, pos in widgets:
+                self._add_widget(widget, *pos, transpose)
+
+    def _move_boundary(self, widget, after, transpose, cells):
+        """Moves one of the vertical edges of a widget.
+
+        Every widget that shares the moved edge is resized, and only those.
+
+        Args:
+            widget: The widget whose edge will be moved.
+            after: True to move the right edge, False to move the left one.
+            transpose: If True, will behave as if the grid was transposed.
+            cells: The number of cells the widget will grow. Negative values
+                   shrink it.
+        """
+        pos = self._get_item_position(widget, transpose)
+        edge = pos[1] + pos[3] if after else pos[1]
+        displacement = cells if after else -cells
+        if not 0 < edge < self.max_span:
+            raise SplitLimitException
+
+        # Extend the edge until it doesn't cut any widget on both sides
+        top = pos[0]
+        bottom = pos[0] + pos[2]
+        changed = True
+        while changed:
+            changed = False
+            for col in (edge - 1, edge):
+                row = top
+                while row < bottom:
+                    tmp_pos = self._get_item_position(
+                        self._item_at_position(row, col, transpose).widget(),
+                        transpose
+                    )
+                    if tmp_pos[0] < top or tmp_pos[0] + tmp_pos[2] > bottom:
+                        top = min(top, tmp_pos[0])
+                        bottom = max(bottom, tmp_pos[0] + tmp_pos[2])
+                        changed = True
+                    row = tmp_pos[0] + tmp_pos[2]
+
+        widgets = []
+        for col in (edge - 1, edge):
+            row = top
+            while row < bottom:
+                tmp_widget = self._item_at_position(row, col,
+                                                    transpose).widget()
+                tmp_pos = self._get_item_position(tmp_widget, transpose)
+                if col < edge:
+                    new_pos = (*tmp_pos[:3], tmp_pos[3] + displacement)
+                else:
+                    new_pos = (tmp_pos[0], tmp_pos[1] + displacement,
+                               tmp_pos[2], tmp_pos[3] - displacement)
+                if new_pos[3] < 1:
+                    raise SplitLimitException
+                widgets.append((tmp_widget, new_pos))
+                row = tmp_pos[0] + tmp_pos[2]
+        for tmp_widget, _ in widgets:
+            self.removeWidget(tmp_widget)
+        for tmp_widget, new_pos in widgets:
+            self._add_widget(tmp_widget, *new_pos, transpose)
 
     def _rearrange_widgets(self, widgets, domain):
         """Rearranges specified widgets after a split or deletion."""
@@ -497,73 +702,2297 @@ class QTilingLayout(QGridLayout):
         self._fill_spaces(domain)
 
 
-class InvalidBlockException(Exception):
-    """Raised if a Block has no area or doesn't fit in the layout."""
-    pass
+class _TilingLayout(_TilingAlgorithm):
+    """The public API of the tiling layouts.
+
+    It must be combined with a QLayout that provides the QGridLayout methods
+    used to place widgets in cells.
+    """
+
+    # Emitted with a LayoutDiff after every operation that changes the layout
+    layoutChanged = pyqtSignal(object)
+    _computed = pyqtSignal(object)
+    VALIDATION_POLICIES = ('strict', 'trusted', 'end-of-op')
+    PREVIEW_OPERATIONS = ('hsplit', 'vsplit', 'remove_widget', 'swap_widgets',
+                          'move_widget')
+    PREVIEW_CACHE_SIZE = 64
+    # The number of widget positions that the undo history can hold. The
+    # oldest operations are forgotten to stay below it.
+    HISTORY_SIZE = 4096
+    # If True, the invariants are verified after every operation regardless
+    # of the validation policy. It can be set per layout or for every layout
+    check_invariants = False
+    # A TraceRecorder that logs the public operations, if any
+    recorder = None
+    # The worker thread that computes the async operations of every layout,
+    # created on first use
+    _executor = None
+
+    def __init__(self, *args, initial_widget=None, max_span=12,
+                 validation='strict', adaptive=False, undo_limit=0,
+                 **kwargs):
+        """Creates a new QTilingLayout
 
+        Args:
+            initial_widget: A widget that will occupy the whole layout.
+            max_span: The number of rows and columns of the grid.
+            validation: How placements are validated. 'strict' checks every
+                        single placement for overlaps, 'trusted' skips those
+                        checks during the internal rearrangement of an
+                        operation and 'end-of-op' skips them too but verifies
+                        the complete tiling once after each operation.
+            adaptive: If True, the grid resolution is doubled when a split
+                      would hit the max_span limit, and halved back after a
+                      removal when every position allows it.
+            undo_limit: The number of operations that can be undone. The
+                        history is disabled if it's 0.
+        """
+        super().__init__(*args, **kwargs)
+        if validation not in self.VALIDATION_POLICIES:
+            raise ValueError('"validation" must be one of '
+                             '{}'.format(self.VALIDATION_POLICIES))
+        self.max_span = max_span
+        self.validation = validation
+        self.adaptive = adaptive
+        self._base_span = max_span
+        self._in_operation = False
+        self._detached_model = None
+        self._detached_origin = None
+        self._batch_model = None
+        self._maximized_state = None
+        self._widget_ids = WeakKeyDictionary()
+        self._id_widgets = WeakValueDictionary()
+        self._last_widget_id = 0
+        self._hit_index = None
+        self._preview_cache = {}
+        self._undo_stack = deque(maxlen=undo_limit)
+        self._redo_stack = []
+        self._change_start = None
+        self._computed.connect(self._commit_async)
+        if initial_widget:
+            self.addWidget(initial_widget, 0, 0, self.max_span, self.max_span)
 
-class Block:
-    """A rectangular area inside a layout"""
+    def _add_widget(self, widget, row, col, rowspan, colspan, transpose):
+        """Invokes QGridLayout.addWidget on a possibly transposed grid.
 
-    def __init__(self, layout, transpose, i, j, rowspan, colspan):
-        if not (
-                i >= 0 and j >= 0 and rowspan > 0 and colspan > 0
-                and 0 <= i < layout.max_span
-                and 0 <= j < layout.max_span
-                and 0 < i + rowspan <= layout.max_span
-                and 0 < j + colspan <= layout.max_span
-        ):
-            raise InvalidBlockException
-        self.layout = layout
-        self.transpose = transpose
-        self.i = i
-        self.j = j
-        self.rowspan = rowspan
-        self.colspan = colspan
+        Args:
+            widget: Same as in QGridLayout.addWidget.
+            row: Same as in QGridLayout.addWidget.
+            col: Same as in QGridLayout.addWidget.
+            rowspan: Same as in QGridLayout.addWidget.
+            colspan: Same as in QGridLayout.addWidget.
+            transpose: If True, will behave as if the grid was transposed.
+        """
+        if not self._in_operation or self.validation == 'strict':
+            try:
+                EmptyBlock(self, transpose, row, col, rowspan, colspan)
+            except (WidgetInEmptyBlockException, InvalidBlockException):
+                raise WidgetOverlapException from None
 
-    def __repr__(self):
-        return '{}: {}, {}, {}, {}'.format(type(self).__name__, self.i,
-                                           self.j, self.rowspan, self.colspan)
+        if not transpose:
+            return self.addWidget(widget, row, col, rowspan, colspan)
+        else:
+            return self.addWidget(widget, col, row, colspan, rowspan)
 
-    def __eq__(self, other):
-        return (self.layout is other.layout
-                and self.transpose == other.transpose
-                and self.i == other.i
-                and self.j == other.j
-                and self.rowspan == other.rowspan
-                and self.colspan == other.colspan)
+    def _get_item_position(self, widget, transpose):
+        """Invokes QGridLayout.getItemPosition on a possibly transposed grid.
 
+        Args:
+            widget: The widget whose position will be returned.
+            transpose: If True, will behave as if the grid was transposed.
+        """
+        index = self.indexOf(widget)
+        if index < 0:
+            raise WidgetNotInLayoutException(
+                    'QGridLayout.indexOf(widget) returned -1')
+        else:
+            pos = self.getItemPosition(index)
+            return pos if not transpose else (pos[1], pos[0], pos[3], pos[2])
 
-class NonRectangularRecBlockException(Exception):
-    pass
+    def _item_at_position(self, row, col, transpose):
+        """Invokes QGridLayout.itemAtPosition on a possibly transposed grid.
 
+        Args:
+            row: Same as in QGridLayout.itemAtPosition.
+            col: Same as in QGridLayout.itemAtPosition.
+            transpose: If True, will behave as if the grid was transposed.
+        """
+        if not self._is_point_inside_grid(row, col):
+            raise PointOutsideGridException
 
-class RecBlock(Block):
-    """A Block whose widgets are entirely contained in it."""
+        if not transpose:
+            return self.itemAtPosition(row, col)
+        else:
+            return self.itemAtPosition(col, row)
 
-    def __init__(self, layout, transpose, i, j, rowspan, colspan):
-        """Builds a Block that no widget exceeds its limits."""
-        super().__init__(layout, transpose, i, j, rowspan, colspan)
-        index = self.i
-        while index < self.i + self.rowspan:
-            item = self.layout._item_at_position(index, self.j, self.transpose)
-            if item:
-                item_pos = self.layout._get_item_position(item.widget(),
-                                                          self.transpose)
-                if item_pos[1] != self.j:
-                    raise NonRectangularRecBlockException
-                index += item_pos[2]
-            else:
-                index += 1
+    def _get_state(self):
+        """Returns every widget in the layout along with its position"""
+        return [(self.itemAt(i).widget(), self.getItemPosition(i))
+                for i in range(self.count())]
 
-        index = self.i
-        while index < self.i + self.rowspan:
-            item = self.layout._item_at_position(index,
-                                                 self.j + self.colspan - 1,
-                                                 self.transpose)
-            if item:
-                item_pos = self.layout._get_item_position(item.widget(),
-                                                          self.transpose)
+    def _restore_state(self, prev_state):
+        item = self.itemAt(0)
+        while item:
+            widget = item.widget()
+            self.removeWidget(widget)
+            widget.hide()
+            item = self.itemAt(0)
+        for widget, pos in prev_state:
+            widget.show()
+            self.addWidget(widget, *pos)
+
+    def _apply_state(self, new_state, old_span=None):
+        """Moves the widgets to the positions in new_state.
+
+        Only the widgets whose position changed are touched. Widgets missing
+        from new_state are removed from the layout and hidden.
+
+        Args:
+            new_state: A list of widgets and positions as returned by
+                       _get_state.
+            old_span: Same as in _emit_changes.
+        """
+        old_state = self._get_state()
+        old_positions = dict(old_state)
+        new_positions = dict(new_state)
+        for widget, pos in old_state:
+            if new_positions.get(widget) != pos:
+                self.removeWidget(widget)
+                if widget not in new_positions:
+                    widget.hide()
+        for widget, pos in new_state:
+            if old_positions.get(widget) != pos:
+                self.addWidget(widget, *pos)
+        self._emit_changes(old_state, new_state, old_span=old_span)
+
+    def _apply_diff(self, diff):
+        """Moves, removes and adds only the widgets listed in a LayoutDiff."""
+        for widget, _ in diff.removed:
+            self.removeWidget(widget)
+            widget.hide()
+        for widget, _, _ in diff.moved:
+            self.removeWidget(widget)
+        for widget, _, pos in diff.moved:
+            self.addWidget(widget, *pos)
+        for widget, pos in diff.added:
+            self.addWidget(widget, *pos)
+            widget.show()
+
+    def _emit_changes(self, old_state, new_state=None, undoable=True,
+                      old_span=None):
+        """Emits layoutChanged if there are differences between two states.
+
+        The differences are also added to the undo history if it's enabled.
+
+        Args:
+            old_state: A list of widgets and positions as returned by
+                       _get_state.
+            new_state: Same as old_state. Defaults to the current state.
+            undoable: If False, the changes are not added to the history.
+            old_span: The max_span of old_state. Defaults to the current one.
+        """
+        if self._change_start is not None:
+            return
+        undoable = undoable and self._undo_stack.maxlen > 0
+        diff = None
+        if undoable or self.receivers(self.layoutChanged):
+            if new_state is None:
+                new_state = self._get_state()
+            diff = LayoutDiff.between(old_state, new_state)
+            if undoable:
+                self._record_history(diff, old_span)
+        self._emit_diff(diff)
+
+    def _record_history(self, diff, old_span=None):
+        """Adds a diff to the undo history and forgets what could be redone.
+
+        Args:
+            diff: The LayoutDiff of the operation. Nothing is recorded if
+                  it's empty or the history is disabled.
+            old_span: Same as in _emit_changes.
+        """
+        if diff and self._undo_stack.maxlen > 0:
+            self._undo_stack.append(_HistoryEntry(
+                _weak_diff(diff),
+                self.max_span if old_span is None else old_span,
+                self.max_span))
+            self._redo_stack.clear()
+            size = sum(len(entry.diff.added) + len(entry.diff.removed)
+                       + len(entry.diff.moved) for entry in self._undo_stack)
+            while size > self.HISTORY_SIZE:
+                entry = self._undo_stack.popleft()
+                size -= (len(entry.diff.added) + len(entry.diff.removed)
+                         + len(entry.diff.moved))
+
+    @contextmanager
+    def _single_change(self):
+        """Reports the changes made inside the block as a single one.
+
+        Nothing is emitted or added to the history until the block exits.
+        Then the differences with the state before the block are emitted
+        and recorded at once, even if an exception escapes it.
+        """
+        if self._change_start is not None:
+            yield
+            return
+        self._change_start = (self._get_state(), self.max_span)
+        try:
+            yield
+        finally:
+            old_state, old_span = self._change_start
+            self._change_start = None
+            self._emit_changes(old_state, old_span=old_span)
+
+    def _emit_diff(self, diff):
+        """Forgets what depends on the state and emits layoutChanged.
+
+        Args:
+            diff: The LayoutDiff to emit. Nothing is emitted if it's empty or
+                  None.
+        """
+        self._hit_index = None
+        self._preview_cache.clear()
+        if diff:
+            self.layoutChanged.emit(diff)
+
+    @_recorded
+    def undo(self):
+        """Reverts the last operation that changed the layout.
+
+        Only the widgets affected by the operation are touched. Maximizing
+        is not part of the history, and the operations performed while the
+        layout was detached are a single entry. The history holds up to
+        undo_limit operations and HISTORY_SIZE widget positions, and it
+        doesn't keep widgets alive.
+
+        Returns:
+            False if there was nothing to undo, if a widget involved in the
+            operation has been destroyed or if the positions it changed were
+            modified by other means. In the last two cases the rest of the
+            history is discarded too.
+        """
+        return self._step_history(self._undo_stack, self._redo_stack, True)
+
+    @_recorded
+    def redo(self):
+        """Performs again the last operation reverted by undo.
+
+        Returns:
+            The same as undo.
+        """
+        return self._step_history(self._redo_stack, self._undo_stack, False)
+
+    def can_undo(self):
+        return bool(self._undo_stack)
+
+    def can_redo(self):
+        return bool(self._redo_stack)
+
+    def _step_history(self, source, target, backwards):
+        """Moves the last entry of source to target and applies it.
+
+        Args:
+            source: The stack from which the entry is taken.
+            target: The stack to which the entry is moved.
+            backwards: If True, the entry is reverted instead of applied.
+        """
+        self.restore()
+        if self._get_grid() is not self:
+            raise RuntimeError('The history cannot be used inside a batch or '
+                               'while the layout is detached')
+        if not source:
+            return False
+        entry = source.pop()
+        diff = _strong_diff(entry.diff)
+        if diff is not None and backwards:
+            diff = diff.inverted()
+        if diff is None or not self._diff_applies(
+                diff, entry.new_span if backwards else entry.old_span):
+            source.clear()
+            if self.recorder is not None:
+                # A replay can't know why the history was discarded
+                self.recorder.replayable = False
+            return False
+        self.max_span = entry.old_span if backwards else entry.new_span
+        self._apply_diff(diff)
+        self._check_operation()
+        target.append(entry)
+        self._emit_diff(diff)
+        return True
+
+    def _diff_applies(self, diff, max_span):
+        """Tells if the old positions of a diff match the grid.
+
+        Args:
+            diff: A LayoutDiff.
+            max_span: The max_span that the old positions refer to.
+        """
+        if max_span != self.max_span:
+            return False
+        try:
+            return (all(self._get_item_position(widget, False) == pos
+                        for widget, pos in diff.removed)
+                    and all(self._get_item_position(widget, False) == pos
+                            for widget, pos, _ in diff.moved)
+                    and all(self.indexOf(widget) == -1
+                            for widget, _ in diff.added))
+        except WidgetNotInLayoutException:
+            return False
+
+    @_recorded
+    def maximize(self, widget):
+        """Makes a widget occupy the whole layout until restore is called.
+
+        The rest of the widgets are taken out of the grid and hidden, and the
+        current positions are kept to be put back by restore. Any operation
+        that modifies the layout calls restore first. Queries like can_hsplit
+        or preview are answered for the restored layout.
+        """
+        self.restore()
+        if self._get_grid() is not self:
+            raise RuntimeError('A widget cannot be maximized inside a batch '
+                               'or while the layout is detached')
+        self._get_item_position(widget, False)
+        state = self._get_state()
+        for tmp_widget, _ in state:
+            self.removeWidget(tmp_widget)
+            if tmp_widget is not widget:
+                tmp_widget.hide()
+        self.addWidget(widget, 0, 0, self.max_span, self.max_span)
+        self._maximized_state = state
+        self._emit_changes(state, [(widget, (0, 0, self.max_span,
+                                             self.max_span))],
+                           undoable=False)
+
+    @_recorded
+    def restore(self):
+        """Puts back the positions that the layout had before maximize."""
+        if self._maximized_state is None:
+            return
+        maximized_state = self._get_state()
+        for widget, _ in maximized_state:
+            self.removeWidget(widget)
+        for widget, pos in self._maximized_state:
+            self.addWidget(widget, *pos)
+            if widget is not maximized_state[0][0]:
+                widget.show()
+        self._maximized_state = None
+        self._emit_changes(maximized_state, undoable=False)
+
+    def is_maximized(self):
+        return self._maximized_state is not None
+
+    @_recorded
+    def detach(self):
+        """Takes every widget out of the grid while remembering the tiling.
+
+        A detached layout holds no items, so Qt doesn't need to compute any
+        geometry for it. Its widgets are hidden until attach is called.
+        Meanwhile the tiling is kept in a TilingModel, so operations and
+        queries keep working on it, like in a batch.
+        """
+        self.restore()
+        if self._detached_model is not None:
+            return
+        state = self._get_state()
+        self._detached_model = TilingModel(self.max_span, state)
+        self._detached_origin = state, self.max_span
+        for widget, _ in state:
+            self.removeWidget(widget)
+            widget.hide()
+        self._emit_changes(state, [], undoable=False)
+
+    @_recorded
+    def attach(self):
+        """Puts the widgets of a detached layout back in the grid.
+
+        The operations performed while detached are added to the history as
+        a single one.
+        """
+        if self._detached_model is None:
+            return
+        state = self._detached_model._get_state()
+        self._detached_model = None
+        for widget, pos in state:
+            self.addWidget(widget, *pos)
+            widget.show()
+        self._emit_changes([], state, undoable=False)
+        old_state, old_span = self._detached_origin
+        self._detached_origin = None
+        self._record_history(LayoutDiff.between(old_state, state), old_span)
+
+    def is_detached(self):
+        return self._detached_model is not None
+
+    def _check_operation(self):
+        """Verifies the tiling after an operation if it was requested."""
+        if self.validation == 'end-of-op' or self.check_invariants:
+            self._verify_tiling()
+
+    @_recorded
+    def remove_widget(self, widget):
+        """Removes a widget from the layout and fills the remaining space"""
+        self.restore()
+        with self._single_change():
+            self._remove_widget_once(widget)
+            if self.adaptive:
+                self._coarsen()
+
+    def _remove_widget_once(self, widget):
+        """Removes a widget without changing the resolution of the grid."""
+        model = self._get_grid()
+        if model is not self:
+            model.remove_widget(widget)
+        elif self.count() == 1:
+            original_state = self._get_state()
+            self.removeWidget(widget)
+            self._emit_changes(original_state)
+        else:
+            # The rearrangement passes may visit the whole layout, so they
+            # run on a model and only the widgets that moved touch the grid
+            original_state = self._get_state()
+            try:
+                self._run_on_model(TilingModel._remove_widget, widget)
+            except Exception as e:
+                raise SplitException(original_state, widget, 'remove') from e
+
+    @_recorded
+    def remove_widgets(self, widgets):
+        """Removes several widgets from the layout at once.
+
+        The result is computed on a TilingModel, rearranging the whole
+        layout only once, and applied to the layout in a single step. If any
+        of the widgets can't be removed the layout is left untouched.
+
+        Args:
+            widgets: An iterable with the widgets to remove.
+        """
+        self.restore()
+        widgets = list(dict.fromkeys(widgets))
+        grid = self._get_grid()
+        original_state = grid._get_state()
+        with self._single_change():
+            widget = None
+            try:
+                for widget in widgets:
+                    grid._get_item_position(widget, False)
+                # Errors past this point are not caused by a single widget
+                widget = None
+                if grid is self and len(widgets) == self.count():
+                    for tmp_widget in widgets:
+                        self.removeWidget(tmp_widget)
+                        tmp_widget.hide()
+                else:
+                    self._run_on_model(TilingModel._remove_widgets, widgets)
+            except Exception as e:
+                raise SplitException(original_state, widget, 'remove') from e
+            if self.adaptive:
+                self._coarsen()
+
+    @_recorded
+    def move_boundary(self, widget, direction, cells):
+        """Moves one of the edges of a widget, resizing it and its neighbours.
+
+        Only the widgets that share the moved edge are resized. The edge is
+        extended as needed so it doesn't cut through any widget.
+
+        Args:
+            widget: The widget whose edge will be moved.
+            direction: 'left', 'top', 'right' or 'bottom'.
+            cells: The number of cells the edge will be moved in the requested
+                   direction. Negative values move it in the opposite one.
+
+        Raises:
+            SplitLimitException: If the edge is one of the layout's edges or
+                                 a widget would end up with no cells.
+        """
+        self.restore()
+        directions = ('left', 'top', 'right', 'bottom')
+        if direction not in directions:
+            raise ValueError('"direction" must be one of '
+                             '{}'.format(directions))
+        after = direction in ('right', 'bottom')
+        transpose = direction in ('top', 'bottom')
+        grid = self._get_grid()
+        original_state = grid._get_state()
+        self._in_operation = True
+        try:
+            grid._move_boundary(widget, after, transpose, cells)
+        finally:
+            self._in_operation = False
+        if grid is self:
+            self._check_operation()
+            self._emit_changes(original_state)
+
+    @_recorded
+    def equalize(self):
+        """Balances the sizes of every widget in both directions at once."""
+        self.restore()
+        self._run_on_model(TilingModel._equalize, (False, True))
+
+    @_recorded
+    def hequalize(self):
+        """Balances the heights of the widgets split horizontally."""
+        self.restore()
+        self._run_on_model(TilingModel._equalize, (True,))
+
+    @_recorded
+    def vequalize(self):
+        """Balances the widths of the widgets split vertically."""
+        self.restore()
+        self._run_on_model(TilingModel._equalize, (False,))
+
+    @_recorded
+    def swap_widgets(self, widget_a, widget_b):
+        """Exchanges the positions of two widgets without rearranging."""
+        self.restore()
+        grid = self._get_grid()
+        original_state = grid._get_state()
+        self._in_operation = True
+        try:
+            grid._swap_widgets(widget_a, widget_b)
+        finally:
+            self._in_operation = False
+        if grid is self:
+            self._check_operation()
+            self._emit_changes(original_state)
+
+    @_recorded
+    def move_widget(self, widget, target, side):
+        """Moves a widget next to another one.
+
+        This is the same as removing the widget and splitting target with
+        it, but the result is computed on a TilingModel and applied at once.
+        If the split is not possible the layout is left untouched.
+
+        Args:
+            widget: The widget to move.
+            target: The widget that will be split to make room for widget.
+            side: The side of target where widget will be placed. One of
+                  'left', 'top', 'right' or 'bottom'.
+        """
+        self.restore()
+        sides = ('left', 'top', 'right', 'bottom')
+        if side not in sides:
+            raise ValueError('"side" must be one of {}'.format(sides))
+        self._run_refining(self._run_on_model, TilingModel._move_widget,
+                           widget, target, side)
+
+    @contextmanager
+    def batch(self):
+        """Groups several operations so they are applied to the layout at once.
+
+        Inside the with block, hsplit, vsplit, remove_widget and every query
+        are evaluated on a TilingModel. The result is applied to the layout
+        when the block exits. If an exception escapes the block, the layout is
+        left untouched. Nested blocks join the outermost one.
+        """
+        if self._batch_model is not None:
+            yield self
+            return
+        # Checked here so that a recorder only sees a restore that happens
+        if self.is_maximized():
+            self.restore()
+        with (self.recorder._record_batch() if self.recorder is not None
+              else nullcontext()):
+            self._batch_model = self._get_model()
+            max_span = self.max_span
+            try:
+                yield self
+                model = self._batch_model
+            except BaseException:
+                self.max_span = max_span
+                raise
+            finally:
+                self._batch_model = None
+            if self._detached_model is not None:
+                self._detached_model = model
+                return
+            self._apply_state(model._get_state(), old_span=max_span)
+            self._check_operation()
+
+    @_recorded
+    def hsplit(self, old_widget, new_widget, put_before=False):
+        """Splits the specified widget horizontally.
+
+        Args:
+            old_widget: The widget to split.
+            new_widget: The widget to insert in the new space, or a callable
+                        that builds it. See _split for details.
+            put_before: If True, the new widget will be inserted on top of the
+                        old widget.
+
+        Returns:
+            The inserted widget.
+        """
+
+        return self._split(old_widget, new_widget, put_before, False)
+
+    @_recorded
+    def vsplit(self, old_widget, new_widget, put_before=False):
+        """Splits the specified widget vertically.
+
+        Args:
+            old_widget: The widget to split.
+            new_widget: The widget to insert in the new space, or a callable
+                        that builds it. See _split for details.
+            put_before: If True, the new widget will be inserted to the left of
+                        the old widget.
+
+        Returns:
+            The inserted widget.
+        """
+        return self._split(old_widget, new_widget, put_before, True)
+
+    def hsplit_async(self, old_widget, new_widget, put_before=False):
+        """Same as hsplit, but the new positions are computed in a thread.
+
+        Returns:
+            A concurrent.futures.Future that is resolved with the inserted
+            widget once the new positions have been applied in the GUI
+            thread. If the layout changed while they were being computed,
+            they are computed again.
+        """
+        return self._run_async('hsplit', old_widget, new_widget, put_before)
+
+    def vsplit_async(self, old_widget, new_widget, put_before=False):
+        """Same as vsplit, but the new positions are computed in a thread.
+
+        See hsplit_async for details.
+        """
+        return self._run_async('vsplit', old_widget, new_widget, put_before)
+
+    def remove_widget_async(self, widget):
+        """Same as remove_widget, but the new positions are computed in a
+        thread.
+
+        See hsplit_async for details.
+        """
+        return self._run_async('remove', widget, None, False)
+
+    def _run_async(self, operation, widget, new_widget, put_before):
+        # Checked here so that a recorder only sees a restore that happens
+        if self.is_maximized():
+            self.restore()
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._submit_async(future, (operation, widget, new_widget, put_before,
+                                    object()))
+        return future
+
+    def _submit_async(self, future, request):
+        if _TilingLayout._executor is None:
+            _TilingLayout._executor = ThreadPoolExecutor(max_workers=1)
+        _TilingLayout._executor.submit(self._compute_async, future, request,
+                              self._get_async_input())
+
+    def _get_async_input(self):
+        """Returns the max_span, the state and the adaptive flag that async
+        operations use."""
+        model = self._get_model()
+        return model.max_span, model._get_state(), self.adaptive
+
+    def _compute_async(self, future, request, async_input):
+        """Computes an operation from a snapshot of the state.
+
+        This runs in a worker thread so it must not touch Qt or the layout.
+        The result is sent back to the GUI thread through the _computed
+        signal.
+
+        Args:
+            future: The Future of the operation.
+            request: The operation, as built by _run_async.
+            async_input: What _get_async_input returned when the operation
+                         was submitted.
+        """
+        operation, widget, _, put_before, placeholder = request
+        max_span, state, adaptive = async_input
+        model = TilingModel(max_span, state)
+        try:
+            if operation != 'remove':
+                model = self._run_on_refined_model(
+                    model,
+                    lambda model: model._split_widgets(
+                        widget, placeholder, put_before,
+                        operation == 'vsplit'),
+                    adaptive)
+            elif model.count() == 1:
+                model._get_item_position(widget, False)
+                model.removeWidget(widget)
+            else:
+                model._remove_widget(widget)
+            result = model.max_span, model._get_state()
+        except Exception as e:
+            result = e
+        self._computed.emit((future, request, async_input, result))
+
+    def _commit_async(self, computed):
+        """Applies the result of _compute_async in the GUI thread.
+
+        A recorder sees the operation as its synchronous counterpart,
+        performed at this point.
+        """
+        future, request, async_input, result = computed
+        if self._get_async_input() != async_input:
+            self._submit_async(future, request)
+            return
+        operation, widget, new_widget, put_before, _ = request
+        if operation == 'remove':
+            name, args, kwargs = 'remove_widget', (widget,), {}
+        else:
+            name, args = operation, (widget, new_widget)
+            kwargs = {'put_before': True} if put_before else {}
+
+        def apply():
+            return self._apply_async_result(request, async_input, result)
+        try:
+            if self.recorder is None:
+                new_widget = apply()
+            else:
+                new_widget = self.recorder._record(name, args, kwargs, apply)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(new_widget)
+
+    def _apply_async_result(self, request, async_input, result):
+        """Applies what _compute_async returned or raises what it failed with.
+
+        Returns:
+            The inserted widget, or None for a removal.
+        """
+        operation, widget, new_widget, _, placeholder = request
+        if isinstance(result, SplitLimitException):
+            raise result
+        if isinstance(result, Exception):
+            raise SplitException(async_input[1], widget, operation) from result
+        max_span, result = result
+        if operation != 'remove':
+            if callable(new_widget):
+                new_widget = new_widget(dict(result)[placeholder])
+            result = [(new_widget if w is placeholder else w, pos)
+                      for w, pos in result]
+        else:
+            new_widget = None
+        self.restore()
+        with self._single_change():
+            old_span = self.max_span
+            self.max_span = max_span
+            if self._get_grid() is not self:
+                self._set_grid(TilingModel(max_span, result))
+            else:
+                self._apply_state(result, old_span)
+                self._check_operation()
+            if operation == 'remove' and self.adaptive:
+                self._coarsen()
+        return new_widget
+
+    def can_hsplit(self, widget, put_before=False, return_geometry=False):
+        """Tells if hsplit would succeed without modifying the layout.
+
+        Args:
+            widget: The widget to split.
+            put_before: Same as in hsplit.
+            return_geometry: If True, the resulting positions are returned
+                             too.
+
+        Returns:
+            A bool or, if return_geometry is True, a tuple with the bool and
+            the resulting list of widgets and positions, in which the new
+            widget is represented by None. The list is None if the split is
+            not possible. If an adaptive layout would have to double its
+            resolution, the positions are in a grid of twice max_span.
+        """
+        return self._can_split(widget, put_before, False, return_geometry)
+
+    def can_vsplit(self, widget, put_before=False, return_geometry=False):
+        """Tells if vsplit would succeed without modifying the layout.
+
+        See can_hsplit for details.
+        """
+        return self._can_split(widget, put_before, True, return_geometry)
+
+    def can_remove(self, widget, return_geometry=False):
+        """Tells if remove_widget would succeed without modifying the layout.
+
+        See can_hsplit for details. If an adaptive layout would halve its
+        resolution, the positions are in the grid it would end up with.
+        """
+        model = self._get_model()
+        model._get_item_position(widget, False)
+        try:
+            if model.count() == 1:
+                model.removeWidget(widget)
+            else:
+                model._remove_widget(widget)
+        except SplitLimitException:
+            return (False, None) if return_geometry else False
+        if not return_geometry:
+            return True
+        if self.adaptive:
+            model = self._coarsened_model(model)
+        return True, model._get_state()
+
+    def _can_split(self, widget, put_before, transpose, return_geometry):
+        placeholder = object()
+        try:
+            model = self._run_on_refined_model(
+                self._get_model(),
+                lambda model: model._split_widgets(widget, placeholder,
+                                                   put_before, transpose),
+                self.adaptive)
+        except SplitLimitException:
+            return (False, None) if return_geometry else False
+        if not return_geometry:
+            return True
+        return True, [(None if w is placeholder else w, pos)
+                      for w, pos in model._get_state()]
+
+    def preview(self, operation, *args):
+        """Computes the result of an operation without modifying the layout.
+
+        The result is cached until the layout changes, so it can be called
+        repeatedly while the same operation is being considered, like when
+        dragging a widget over a target. Changes made through the QGridLayout
+        methods don't clear the cache.
+
+        Args:
+            operation: The name of one of the PREVIEW_OPERATIONS.
+            args: The arguments of the operation, except for the new widget of
+                  a split, which must be omitted.
+
+        Returns:
+            A LayoutDiff with the widgets that the operation would add, remove
+            or move, in which the new widget of a split is represented by
+            None. If the operation is not possible, None is returned. If an
+            adaptive layout would have to double its resolution for a split
+            or a move, the positions are in a grid of twice max_span and
+            every remaining widget is listed as moved. Likewise, if it would
+            halve its resolution after a removal, the positions are in the
+            grid it would end up with. In both cases the max_span of that
+            grid is the largest row + rowspan among the new positions.
+        """
+        if operation not in self.PREVIEW_OPERATIONS:
+            raise ValueError('"operation" must be one of '
+                             '{}'.format(self.PREVIEW_OPERATIONS))
+        use_cache = self._get_grid() is self
+        key = (operation, args)
+        if use_cache and key in self._preview_cache:
+            return self._preview_cache[key]
+        model = self._get_model()
+        original_state = model._get_state()
+        placeholder = object()
+
+        def run(model):
+            if operation in ('hsplit', 'vsplit'):
+                widget, put_before = (args + (False,))[:2]
+                model._split_widgets(widget, placeholder, put_before,
+                                     operation == 'vsplit')
+            elif operation == 'remove_widget' and model.count() == 1:
+                model._get_item_position(*args, False)
+                model.removeWidget(*args)
+            else:
+                getattr(model, '_' + operation)(*args)
+        try:
+            model = self._run_on_refined_model(
+                model, run, self.adaptive and operation in ('hsplit', 'vsplit',
+                                                            'move_widget'))
+        except SplitLimitException:
+            diff = None
+        else:
+            if operation == 'remove_widget' and self.adaptive:
+                model = self._coarsened_model(model)
+            diff = LayoutDiff.between(
+                original_state, [(None if w is placeholder else w, pos)
+                                 for w, pos in model._get_state()])
+        if use_cache:
+            if len(self._preview_cache) >= self.PREVIEW_CACHE_SIZE:
+                self._preview_cache.clear()
+            self._preview_cache[key] = diff
+        return diff
+
+    def position_rect(self, position, max_span=None):
+        """Returns the QRect covered by a position in the current geometry.
+
+        Args:
+            position: A (row, col, rowspan, colspan) tuple, like the ones in
+                      the diffs returned by preview.
+            max_span: The resolution of the grid in which position is
+                      expressed, if it's not the current one. It must be a
+                      multiple or a divisor of the current max_span.
+        """
+        row, col, rowspan, colspan = position
+        if max_span is not None and max_span < self.max_span:
+            scale = self.max_span // max_span
+            row, col, rowspan, colspan = (x * scale for x in position)
+            max_span = None
+        factor = 1 if max_span is None else max_span // self.max_span
+        # With a finer grid, every current cell is split in equal parts
+        first = self.cellRect(row // factor, col // factor)
+        last = self.cellRect((row + rowspan - 1) // factor,
+                             (col + colspan - 1) // factor)
+        left = first.x() + first.width() * (col % factor) // factor
+        top = first.y() + first.height() * (row % factor) // factor
+        right = (last.x() - 1 + last.width()
+                 * ((col + colspan - 1) % factor + 1) // factor)
+        bottom = (last.y() - 1 + last.height()
+                  * ((row + rowspan - 1) % factor + 1) // factor)
+        return QRect(left, top, right - left + 1, bottom - top + 1)
+
+    def _get_model(self):
+        """Returns a TilingModel with the current state of the layout.
+
+        If a widget is maximized, the model has the state that restore would
+        put back.
+        """
+        if self._maximized_state is not None:
+            return TilingModel(self.max_span, self._maximized_state)
+        return self._get_grid().copy()
+
+    def _run_on_model(self, method, *args):
+        """Runs a _TilingAlgorithm method on a TilingModel and applies it.
+
+        Inside a batch or while detached the method runs on the model
+        returned by _get_grid, which is restored if it fails. Otherwise it
+        runs on a model with the current state and the result is applied to
+        the layout at once if it succeeds.
+
+        Args:
+            method: The unbound method to run.
+            args: The arguments for method.
+
+        Returns:
+            Whatever method returns.
+        """
+        grid = self._get_grid()
+        deferred = grid is not self
+        model = grid if deferred else self._get_model()
+        original_state = model._get_state()
+        try:
+            result = method(model, *args)
+        except Exception:
+            if deferred:
+                self._set_grid(TilingModel(self.max_span, original_state))
+            raise
+        if not deferred:
+            self._apply_state(model._get_state())
+            self._check_operation()
+        return result
+
+    def _rescale(self, multiplier, divisor, state=None):
+        """Changes the resolution of the grid keeping the proportions.
+
+        Every position and span is multiplied by multiplier and divided by
+        divisor, which must leave them as integers.
+
+        Args:
+            multiplier: The factor applied to max_span and every position.
+            divisor: The divisor applied to max_span and every position.
+            state: The state to rescale. Defaults to the current one.
+        """
+        grid = self._get_grid()
+        if state is None:
+            state = grid._get_state()
+        state = [(widget, tuple(x * multiplier // divisor for x in pos))
+                 for widget, pos in state]
+        old_span = self.max_span
+        self.max_span = self.max_span * multiplier // divisor
+        if grid is self:
+            self._apply_state(state, old_span)
+        else:
+            self._set_grid(TilingModel(self.max_span, state))
+
+    def _coarsen(self):
+        """Halves the resolution of the grid as long as it's possible.
+
+        The resolution is never brought below the max_span the layout was
+        created with. QGridLayout has no way to drop rows or columns, so the
+        rowCount and columnCount of a QTilingLayout keep the highest
+        resolution it had. The extra rows and columns are empty and take no
+        space, so use max_span to know the current resolution.
+        QTilingGeometryLayout does shrink.
+        """
+        state = self._get_grid()._get_state()
+        divisor = self._coarsening_divisor(state)
+        if divisor > 1:
+            self._rescale(1, divisor, state)
+
+    def _coarsened_model(self, model):
+        """Same as _coarsen, but on a model that is not applied.
+
+        Returns:
+            The model, or a new TilingModel with the lower resolution.
+        """
+        state = model._get_state()
+        divisor = self._coarsening_divisor(state)
+        if divisor == 1:
+            return model
+        return TilingModel(model.max_span // divisor,
+                           [(widget, tuple(x // divisor for x in pos))
+                            for widget, pos in state])
+
+    def _coarsening_divisor(self, state):
+        """Returns the power of 2 by which _coarsen would divide max_span.
+
+        Args:
+            state: The state of a grid of max_span rows and columns.
+        """
+        divisor = 1
+        while (self.max_span // divisor // 2 >= self._base_span
+               and self.max_span // divisor % 2 == 0
+               and not any(x % (divisor * 2) for _, pos in state
+                           for x in pos)):
+            divisor *= 2
+        return divisor
+
+    def _get_grid(self):
+        """Returns what operations must act on.
+
+        That is the batch TilingModel while in a batch, the model that keeps
+        the tiling while the layout is detached, or otherwise self.
+        """
+        if self._batch_model is not None:
+            return self._batch_model
+        if self._detached_model is not None:
+            return self._detached_model
+        return self
+
+    def _set_grid(self, model):
+        """Replaces the TilingModel returned by _get_grid."""
+        if self._batch_model is not None:
+            self._batch_model = model
+        else:
+            self._detached_model = model
+
+    def copy(self):
+        """Returns a TilingModel with the current state of the layout."""
+        return TilingModel(self.max_span, self._get_state())
+
+    @_recorded
+    def snapshot(self):
+        """Returns a LayoutSnapshot with the current state of the layout.
+
+        A widget keeps the same id in every snapshot for as long as it lives.
+        """
+        return LayoutSnapshot.from_state(
+            self.max_span, [(self._get_widget_id(widget), pos)
+                            for widget, pos in self._get_grid()._get_state()])
+
+    @_recorded
+    def apply_snapshot(self, snapshot):
+        """Moves the widgets to the positions stored in a LayoutSnapshot.
+
+        The snapshot may have been computed from another one, for example on
+        a TilingModel built with TilingModel.from_snapshot, but it can only
+        reference widgets that have been in a snapshot of this layout. The
+        tiling of the snapshot is verified before the layout is touched.
+
+        Raises:
+            ValueError: If the snapshot has a different max_span.
+            WidgetNotInLayoutException: If the snapshot has an unknown id.
+            WidgetOverlapException: If two widgets of the snapshot share a
+                                    cell or one exceeds the limits of the
+                                    grid.
+            EmptySpaceInLayoutException: If a cell is not covered by any
+                                         widget of the snapshot.
+        """
+        self.restore()
+        if snapshot.max_span != self.max_span:
+            raise ValueError('The snapshot was taken with a different '
+                             'max_span')
+        try:
+            state = [(self._id_widgets[widget_id], pos)
+                     for widget_id, pos in snapshot.get_state()]
+        except KeyError as e:
+            raise WidgetNotInLayoutException(
+                'Unknown widget id {}'.format(e.args[0])) from None
+        model = TilingModel(self.max_span)
+        for widget, pos in state:
+            model._add_widget(widget, *pos, False)
+        # A widget listed twice leaves the cells of its first position empty
+        model._verify_tiling()
+        if self._get_grid() is not self:
+            self._set_grid(model)
+        else:
+            self._apply_state(state)
+            self._check_operation()
+
+    def _get_widget_id(self, widget):
+        """Returns the id that represents a widget in snapshots."""
+        widget_id = self._widget_ids.get(widget)
+        if widget_id is None:
+            self._last_widget_id += 1
+            widget_id = self._widget_ids[widget] = self._last_widget_id
+            self._id_widgets[widget_id] = widget
+        return widget_id
+
+    @_recorded
+    def get_left_neighbour(self, widget):
+        return self._get_grid()._get_neighbour(widget, True, False)
+
+    @_recorded
+    def get_top_neighbour(self, widget):
+        return self._get_grid()._get_neighbour(widget, True, True)
+
+    @_recorded
+    def get_right_neighbour(self, widget):
+        return self._get_grid()._get_neighbour(widget, False, False)
+
+    @_recorded
+    def get_bottom_neighbour(self, widget):
+        return self._get_grid()._get_neighbour(widget, False, True)
+
+    def setGeometry(self, rect):
+        super().setGeometry(rect)
+        self._hit_index = None
+
+    def widget_at(self, point):
+        """Returns the widget at a point, or None if there is none.
+
+        Args:
+            point: A QPoint in the coordinates of the parent widget.
+        """
+        col_lefts, cols, row_tops, rows = self._get_hit_index()
+        col = bisect_right(col_lefts, point.x()) - 1
+        row = bisect_right(row_tops, point.y()) - 1
+        if row < 0 or col < 0:
+            return None
+        widget = self._item_at_position(rows[row], cols[col], False).widget()
+        return widget if widget.geometry().contains(point) else None
+
+    def widgets_in_rect(self, rect):
+        """Returns the widgets that intersect a rectangle.
+
+        Args:
+            rect: A QRect in the coordinates of the parent widget.
+        """
+        col_lefts, cols, row_tops, rows = self._get_hit_index()
+        first_col = max(bisect_right(col_lefts, rect.left()) - 1, 0)
+        last_col = bisect_right(col_lefts, rect.right())
+        first_row = max(bisect_right(row_tops, rect.top()) - 1, 0)
+        last_row = bisect_right(row_tops, rect.bottom())
+        widgets = {}
+        for row in rows[first_row:last_row]:
+            for col in cols[first_col:last_col]:
+                widget = self._item_at_position(row, col, False).widget()
+                if widget not in widgets:
+                    widgets[widget] = widget.geometry().intersects(rect)
+        return [widget for widget, intersects in widgets.items()
+                if intersects]
+
+    def _get_hit_index(self):
+        """Returns the index used to map pixels to cells.
+
+        The index holds the left edges of the columns in which a widget
+        starts, along with those columns, and the same for rows, sorted by
+        pixel. Any point belongs to the cell given by the last edge before
+        it in each direction, which is found with a binary search. The index
+        is built from the geometry of the widgets the first time it's needed
+        after an operation or a change of geometry.
+        """
+        if self._hit_index is None:
+            col_lefts = {}
+            row_tops = {}
+            for widget, pos in self._get_state():
+                geometry = widget.geometry()
+                col_lefts[pos[1]] = geometry.left()
+                row_tops[pos[0]] = geometry.top()
+            cols = sorted(col_lefts)
+            rows = sorted(row_tops)
+            self._hit_index = ([col_lefts[col] for col in cols], cols,
+                               [row_tops[row] for row in rows], rows)
+        return self._hit_index
+
+    def _split(self, old_widget, new_widget, put_before, transpose):
+        """Splits the specified widget.
+
+        If new_widget is a callable, the split is first computed on a
+        TilingModel and the callable is only invoked if it succeeds. It
+        receives the final position of the new widget as a (row, col,
+        rowspan, colspan) tuple and must return the widget to insert.
+
+        Args:
+            old_widget: The widget to split.
+            new_widget: The widget to insert in the new space, or a callable
+                        that builds it.
+            put_before: If True, the new widget will be inserted on top the
+                        old widget.
+            transpose: If True, will behave as if the grid was transposed.
+
+        Returns:
+            The inserted widget.
+        """
+        self.restore()
+        return self._run_refining(self._split_once, old_widget, new_widget,
+                                  put_before, transpose)
+
+    def _run_refining(self, operation, *args):
+        """Runs an operation that may need a finer grid, as a single change.
+
+        If the layout is adaptive and the operation hits the max_span limit,
+        the resolution is doubled and the operation is tried once more.
+
+        Args:
+            operation: The callable that performs the operation.
+            args: The arguments for operation.
+
+        Returns:
+            Whatever operation returns.
+        """
+        with self._single_change():
+            try:
+                return operation(*args)
+            except SplitLimitException:
+                if not self.adaptive or self.max_span * 2 > 0xffff:
+                    raise
+            self._rescale(2, 1)
+            try:
+                return operation(*args)
+            except SplitLimitException:
+                self._rescale(1, 2)
+                raise
+
+    @staticmethod
+    def _run_on_refined_model(model, operation, adaptive):
+        """Same as _run_refining, but on a model that is not applied.
+
+        This doesn't touch the layout, so it can run in a worker thread.
+
+        Args:
+            model: The TilingModel on which to run the operation.
+            operation: A callable that receives the model.
+            adaptive: If False, the resolution is never doubled.
+
+        Returns:
+            The model with the result. It's a new TilingModel with twice the
+            max_span if the resolution had to be doubled.
+        """
+        original_state = model._get_state()
+        try:
+            operation(model)
+            return model
+        except SplitLimitException:
+            if not adaptive or model.max_span * 2 > 0xffff:
+                raise
+        model = TilingModel(model.max_span * 2,
+                            [(widget, tuple(x * 2 for x in pos))
+                             for widget, pos in original_state])
+        operation(model)
+        return model
+
+    def _split_once(self, old_widget, new_widget, put_before, transpose):
+        """Performs a split with the current resolution. See _split."""
+        grid = self._get_grid()
+        original_state = grid._get_state()
+        operation = 'vsplit' if transpose else 'hsplit'
+        if callable(new_widget) or grid is not self:
+            deferred = grid is not self
+            model = grid if deferred else self._get_model()
+            placeholder = object() if callable(new_widget) else new_widget
+            try:
+                model._split_widgets(old_widget, placeholder, put_before,
+                                     transpose)
+            except Exception as e:
+                if deferred:
+                    self._set_grid(TilingModel(self.max_span,
+                                               original_state))
+                if isinstance(e, SplitLimitException):
+                    raise
+                raise SplitException(original_state, old_widget,
+                                     operation) from e
+            if placeholder is not new_widget:
+                pos = model._get_item_position(placeholder, False)
+                new_widget = new_widget(pos)
+                model.removeWidget(placeholder)
+                model.addWidget(new_widget, *pos)
+            if not deferred:
+                self._apply_state(model._get_state())
+                self._check_operation()
+            return new_widget
+
+        self._in_operation = True
+        try:
+            self._split_widgets(old_widget, new_widget, put_before, transpose)
+            self._check_operation()
+        except SplitLimitException:
+            self._restore_state(original_state)
+            raise
+        except Exception as e:
+            raise SplitException(original_state, old_widget, operation) from e
+        finally:
+            self._in_operation = False
+        self._emit_changes(original_state)
+        return new_widget
+
+
+class QTilingLayout(_TilingLayout, QGridLayout):
+    """A tiling layout that relies on QGridLayout to size the cells."""
+
+
+class _CellLayout(QLayout):
+    """A QLayout that places widgets in the cells of an evenly divided grid.
+
+    It implements the subset of the QGridLayout API used by _TilingLayout.
+    Since every row and column has the same size, the geometry of each item
+    is computed with simple arithmetic instead of solving row and column
+    sizes, and it's cached per container geometry.
+    """
+
+    GEOMETRY_CACHE_SIZE = 32
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._items = []
+        self._positions = []
+        self._widget_items = {}
+        self._item_widgets = {}
+        self._cell_items = {}
+        self._geometry_cache = {}
+
+    def addItem(self, item):
+        raise TypeError('Items must be added with addWidget and a position')
+
+    def addWidget(self, widget, row, col, rowspan, colspan):
+        """Same as QGridLayout.addWidget."""
+        self.addChildWidget(widget)
+        item = QWidgetItem(widget)
+        # Like the items created by QLayout.addWidget, it's owned by C++
+        sip.transferto(item, None)
+        self._items.append(item)
+        self._positions.append((row, col, rowspan, colspan))
+        self._widget_items[widget] = item
+        self._item_widgets[item] = widget
+        for i in range(row, row + rowspan):
+            for j in range(col, col + colspan):
+                self._cell_items[i, j] = item
+        self._geometry_cache.clear()
+        self.invalidate()
+
+    def removeWidget(self, widget):
+        """Same as QGridLayout.removeWidget."""
+        index = self.indexOf(widget)
+        if index != -1:
+            sip.delete(self.takeAt(index))
+            # addChildWidget gave the widget to the layout, and like in
+            # QLayout.removeWidget it's given back
+            sip.transferback(widget)
+            self.invalidate()
+
+    def count(self):
+        return len(self._items)
+
+    def itemAt(self, index):
+        if 0 <= index < len(self._items):
+            return self._items[index]
+        return None
+
+    def takeAt(self, index):
+        if not 0 <= index < len(self._items):
+            return None
+        # Qt calls this while a widget is being deleted, when item.widget()
+        # no longer returns the wrapper it was added with
+        item = self._items.pop(index)
+        row, col, rowspan, colspan = self._positions.pop(index)
+        del self._widget_items[self._item_widgets.pop(item)]
+        for i in range(row, row + rowspan):
+            for j in range(col, col + colspan):
+                del self._cell_items[i, j]
+        self._geometry_cache.clear()
+        return item
+
+    def indexOf(self, widget):
+        """Same as QGridLayout.indexOf."""
+        item = self._widget_items.get(widget)
+        return self._items.index(item) if item is not None else -1
+
+    def itemAtPosition(self, row, col):
+        """Same as QGridLayout.itemAtPosition."""
+        return self._cell_items.get((row, col))
+
+    def getItemPosition(self, index):
+        """Same as QGridLayout.getItemPosition."""
+        return self._positions[index]
+
+    def rowCount(self):
+        """Same as QGridLayout.rowCount."""
+        return self._get_span()[0]
+
+    def columnCount(self):
+        """Same as QGridLayout.columnCount."""
+        return self._get_span()[1]
+
+    def expandingDirections(self):
+        return Qt.Horizontal | Qt.Vertical
+
+    def setGeometry(self, rect):
+        super().setGeometry(rect)
+        spacing = max(self.spacing(), 0)
+        margins = self.getContentsMargins()
+        key = (rect.x(), rect.y(), rect.width(), rect.height(), spacing,
+               margins)
+        geometries = self._geometry_cache.get(key)
+        if geometries is None:
+            if len(self._geometry_cache) >= self.GEOMETRY_CACHE_SIZE:
+                self._geometry_cache.clear()
+            geometries = self._compute_geometries(rect, spacing, margins)
+            self._geometry_cache[key] = geometries
+        for item, geometry in zip(self._items, geometries):
+            item.setGeometry(geometry)
+
+    def _compute_geometries(self, rect, spacing, margins):
+        """Returns the QRect of every item for the given layout geometry.
+
+        Args:
+            rect: The geometry of the layout.
+            spacing: The space between adjacent items.
+            margins: The contents margins as (left, top, right, bottom).
+        """
+        span = self._get_span()
+        return [self._compute_rect(rect, spacing, margins, span, pos)
+                for pos in self._positions]
+
+    @staticmethod
+    def _compute_rect(rect, spacing, margins, span, pos):
+        """Returns the QRect of a position for the given layout geometry.
+
+        Args:
+            rect: The geometry of the layout.
+            spacing: The space between adjacent items.
+            margins: The contents margins as (left, top, right, bottom).
+            span: The number of rows and columns of the grid.
+            pos: A (row, col, rowspan, colspan) tuple.
+        """
+        rows, cols = span
+        row, col, rowspan, colspan = pos
+        # Every cell is followed by spacing, the last one included
+        width = rect.width() - margins[0] - margins[2] + spacing
+        height = rect.height() - margins[1] - margins[3] + spacing
+        left = col * width // cols
+        top = row * height // rows
+        right = (col + colspan) * width // cols
+        bottom = (row + rowspan) * height // rows
+        return QRect(rect.x() + margins[0] + left, rect.y() + margins[1] + top,
+                     right - left - spacing, bottom - top - spacing)
+
+    def cellRect(self, row, col):
+        """Same as QGridLayout.cellRect."""
+        return self._compute_rect(self.geometry(), max(self.spacing(), 0),
+                                  self.getContentsMargins(), self._get_span(),
+                                  (row, col, 1, 1))
+
+    def _get_span(self):
+        """Returns the number of rows and columns occupied by the items."""
+        rows = max((pos[0] + pos[2] for pos in self._positions), default=1)
+        cols = max((pos[1] + pos[3] for pos in self._positions), default=1)
+        return rows, cols
+
+    def sizeHint(self):
+        return self._combine_sizes('sizeHint')
+
+    def minimumSize(self):
+        return self._combine_sizes('minimumSize')
+
+    def _combine_sizes(self, method):
+        """Returns the size needed so every cell fits the largest item.
+
+        Args:
+            method: The name of the QLayoutItem method that returns the size
+                    of an item.
+        """
+        spacing = max(self.spacing(), 0)
+        rows, cols = self._get_span()
+        cell_width = cell_height = 0
+        for item, (_, _, rowspan, colspan) in zip(self._items,
+                                                  self._positions):
+            if item.isEmpty():
+                continue
+            size = getattr(item, method)()
+            cell_width = max(cell_width, -(-size.width() // colspan))
+            cell_height = max(cell_height, -(-size.height() // rowspan))
+        left, top, right, bottom = self.getContentsMargins()
+        return QSize(cols * cell_width + (cols - 1) * spacing + left + right,
+                     rows * cell_height + (rows - 1) * spacing + top + bottom)
+
+
+class QTilingGeometryLayout(_TilingLayout, _CellLayout):
+    """A tiling layout that computes the geometry of every widget itself.
+
+    It has the same API as QTilingLayout, but resizing it costs time
+    proportional to the number of widgets instead of the number of cells.
+    """
+
+
+class TilingModel(_TilingAlgorithm):
+    """A Qt-free grid on which tiling operations can be evaluated.
+
+    The model supports the same internal operations as QTilingLayout, but
+    widgets are only used as keys so any hashable object can be placed in it.
+    """
+
+    def __init__(self, max_span, state=()):
+        """Creates a new TilingModel
+
+        Args:
+            max_span: The number of rows and columns of the grid.
+            state: A list of widgets and positions as returned by _get_state.
+        """
+        self.max_span = max_span
+        self._restore_state(state)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Creates a model whose widgets are the ids of a LayoutSnapshot."""
+        return cls(snapshot.max_span, snapshot.get_state())
+
+    def snapshot(self):
+        """Returns a LayoutSnapshot of a model whose widgets are ids."""
+        return LayoutSnapshot.from_state(self.max_span, self._get_state())
+
+    def copy(self):
+        return TilingModel(self.max_span, self._get_state())
+
+    def hsplit(self, old_widget, new_widget, put_before=False):
+        """Same as QTilingLayout.hsplit, but the resolution is never changed.
+
+        new_widget must be the widget to insert, not a callable. If the split
+        fails the model is left untouched.
+        """
+        return self._split(old_widget, new_widget, put_before, False)
+
+    def vsplit(self, old_widget, new_widget, put_before=False):
+        """Same as hsplit, but splits the widget vertically."""
+        return self._split(old_widget, new_widget, put_before, True)
+
+    def remove_widget(self, widget):
+        """Same as QTilingLayout.remove_widget, but the resolution is never
+        changed.
+
+        If the removal fails the model is left untouched.
+        """
+        original_state = self._get_state()
+        try:
+            if self.count() == 1:
+                self._get_item_position(widget, False)
+                self.removeWidget(widget)
+            else:
+                self._remove_widget(widget)
+        except Exception as e:
+            self._restore_state(original_state)
+            raise SplitException(original_state, widget, 'remove') from e
+
+    def _split(self, old_widget, new_widget, put_before, transpose):
+        original_state = self._get_state()
+        try:
+            self._split_widgets(old_widget, new_widget, put_before, transpose)
+        except Exception as e:
+            self._restore_state(original_state)
+            if isinstance(e, SplitLimitException):
+                raise
+            raise SplitException(original_state, old_widget,
+                                 'vsplit' if transpose else 'hsplit') from e
+        return new_widget
+
+    def _restore_state(self, state):
+        """Same as QTilingLayout._restore_state."""
+        self._cells = [[None] * self.max_span for _ in range(self.max_span)]
+        self._items = {}
+        for widget, pos in state:
+            self.addWidget(widget, *pos)
+
+    def count(self):
+        return len(self._items)
+
+    def addWidget(self, widget, row, col, rowspan, colspan):
+        item = _ModelItem(widget, (row, col, rowspan, colspan))
+        self._items[widget] = item
+        for tmp_row in range(row, row + rowspan):
+            cells = self._cells[tmp_row]
+            for tmp_col in range(col, col + colspan):
+                cells[tmp_col] = item
+
+    def removeWidget(self, widget):
+        item = self._items.pop(widget, None)
+        if item:
+            row, col, rowspan, colspan = item.pos
+            for tmp_row in range(row, row + rowspan):
+                cells = self._cells[tmp_row]
+                for tmp_col in range(col, col + colspan):
+                    cells[tmp_col] = None
+
+    def _add_widget(self, widget, row, col, rowspan, colspan, transpose):
+        """Same as QTilingLayout._add_widget."""
+        if transpose:
+            row, col, rowspan, colspan = col, row, colspan, rowspan
+        if not (row >= 0 and col >= 0 and rowspan > 0 and colspan > 0
+                and row + rowspan <= self.max_span
+                and col + colspan <= self.max_span):
+            raise WidgetOverlapException
+        for tmp_row in range(row, row + rowspan):
+            cells = self._cells[tmp_row]
+            for tmp_col in range(col, col + colspan):
+                if cells[tmp_col]:
+                    raise WidgetOverlapException
+        self.addWidget(widget, row, col, rowspan, colspan)
+
+    def _get_item_position(self, widget, transpose):
+        """Same as QTilingLayout._get_item_position."""
+        item = self._items.get(widget)
+        if item is None:
+            raise WidgetNotInLayoutException
+        pos = item.pos
+        return pos if not transpose else (pos[1], pos[0], pos[3], pos[2])
+
+    def _item_at_position(self, row, col, transpose):
+        """Same as QTilingLayout._item_at_position."""
+        if not self._is_point_inside_grid(row, col):
+            raise PointOutsideGridException
+        if not transpose:
+            return self._cells[row][col]
+        else:
+            return self._cells[col][row]
+
+    def _get_state(self):
+        """Same as QTilingLayout._get_state."""
+        return [(widget, item.pos) for widget, item in self._items.items()]
+
+
+class _CutNode:
+    """A region of the layout used by _TilingAlgorithm._equalize.
+
+    A region is either a single widget, a list of regions side by side
+    ('v'), a list of regions on top of each other ('h') or a group of
+    widgets that cannot be cut in any direction ('rigid').
+    """
+
+    __slots__ = ('kind', 'col', 'colspan', 'children', 'items', 'fixed',
+                 'demand')
+
+    def __init__(self, kind, col, colspan, children=(), items=()):
+        self.kind = kind
+        self.col = col
+        self.colspan = colspan
+        self.children = children
+        self.items = items
+        if kind == 'leaf':
+            self.fixed, self.demand = False, 1
+        elif kind == 'rigid':
+            self.fixed, self.demand = True, colspan
+        elif kind == 'v':
+            self.fixed = all(child.fixed for child in children)
+            self.demand = sum(child.demand for child in children)
+        elif any(child.fixed for child in children):
+            self.fixed, self.demand = True, colspan
+        else:
+            self.fixed = False
+            self.demand = max(child.demand for child in children)
+
+    @classmethod
+    def build(cls, items, row, col, rowspan, colspan):
+        """Builds the tree of regions for a list of widgets and positions."""
+        if len(items) == 1:
+            return cls('leaf', col, colspan, items=items)
+        for index, kind in ((1, 'v'), (0, 'h')):
+            start, size = (col, colspan) if kind == 'v' else (row, rowspan)
+            crossed = set()
+            for _, pos in items:
+                crossed.update(range(pos[index] + 1,
+                                     pos[index] + pos[index + 2]))
+            bounds = [start] + [x for x in range(start + 1, start + size)
+                                if x not in crossed] + [start + size]
+            if len(bounds) > 2:
+                children = []
+                for begin, end in zip(bounds, bounds[1:]):
+                    child_items = [(widget, pos) for widget, pos in items
+                                   if begin <= pos[index] < end]
+                    if kind == 'v':
+                        children.append(cls.build(child_items, row, begin,
+                                                  rowspan, end - begin))
+                    else:
+                        children.append(cls.build(child_items, begin, col,
+                                                  end - begin, colspan))
+                return cls(kind, col, colspan, children=children)
+        return cls('rigid', col, colspan, items=items)
+
+    def assign(self, col, colspan, columns):
+        """Distributes a width among the region and its descendants.
+
+        Args:
+            col: The new first column of the region.
+            colspan: The new width of the region.
+            columns: A dict that will be filled with the new (col, colspan)
+                     of every widget.
+        """
+        if self.kind == 'leaf':
+            columns[self.items[0][0]] = (col, colspan)
+        elif self.kind == 'rigid':
+            for widget, pos in self.items:
+                columns[widget] = (col + pos[1] - self.col, pos[3])
+        elif self.kind == 'h':
+            for child in self.children:
+                child.assign(col, colspan, columns)
+        else:
+            flexible = [child for child in self.children if not child.fixed]
+            available = colspan - sum(child.colspan for child in self.children
+                                      if child.fixed)
+            total_demand = sum(child.demand for child in flexible)
+            shares = {}
+            remainders = []
+            for child in flexible:
+                shares[child], remainder = divmod(available * child.demand,
+                                                  total_demand)
+                remainders.append((-remainder, len(remainders), child))
+            left = available - sum(shares.values())
+            for _, _, child in sorted(remainders)[:left]:
+                shares[child] += 1
+            for child in self.children:
+                size = child.colspan if child.fixed else shares[child]
+                child.assign(col, size, columns)
+                col += size
+
+
+class _ModelItem:
+    """Plays the part of a QLayoutItem inside a TilingModel."""
+
+    __slots__ = ('_widget', 'pos')
+
+    def __init__(self, widget, pos):
+        self._widget = widget
+        self.pos = pos
+
+    def widget(self):
+        return self._widget
+
+
+class WorkspaceManager:
+    """Keeps several QTilingLayouts of which only one is shown at a time.
+
+    Every layout that is not the current one is kept detached, so only the
+    widgets of the visible workspace are managed by Qt.
+    """
+
+    def __init__(self):
+        self.workspaces = []
+        self.current = None
+
+    def add_workspace(self, layout):
+        """Adds a layout to the manager. The first one becomes the current."""
+        self.workspaces.append(layout)
+        if self.current is None:
+            self.current = layout
+            layout.attach()
+        else:
+            layout.detach()
+
+    def remove_workspace(self, layout):
+        """Removes a layout from the manager, leaving it attached."""
+        self.workspaces.remove(layout)
+        layout.attach()
+        if layout is self.current:
+            self.current = None
+            if self.workspaces:
+                self.set_current(self.workspaces[0])
+
+    def set_current(self, layout):
+        """Detaches the current workspace and attaches the specified one."""
+        if layout not in self.workspaces:
+            raise ValueError('The layout is not managed by this '
+                             'WorkspaceManager')
+        if layout is self.current:
+            return
+        if self.current is not None:
+            self.current.detach()
+        layout.attach()
+        self.current = layout
+
+
+class NavigationIndex:
+    """Answers directional queries between the widgets of a QTilingLayout.
+
+    For every direction, the edges of the widgets that face it are kept
+    sorted by their coordinate and, for each coordinate, by their starting
+    point along the perpendicular axis. This way the nearest widget in a
+    direction is found with binary searches instead of walking the grid. The
+    index is updated with the diffs emitted by layoutChanged, so it must be
+    rebuilt if the layout is modified through the QGridLayout methods.
+    """
+
+    DIRECTIONS = ('left', 'top', 'right', 'bottom')
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.rebuild()
+        layout.layoutChanged.connect(self._update)
+
+    def rebuild(self):
+        """Builds the index from the current state of the layout."""
+        self._positions = {}
+        self._widgets = {}
+        self._edges = {direction: {} for direction in self.DIRECTIONS}
+        self._coords = {direction: [] for direction in self.DIRECTIONS}
+        for widget, pos in self.layout._get_state():
+            self._add(widget, pos)
+
+    def neighbour(self, widget, direction, wrap=False):
+        """Returns the nearest widget in the requested direction.
+
+        Among the widgets overlapping the requested one along the
+        perpendicular axis, the nearest is returned. If there are more than
+        one, the one with the longest overlap is returned, and then the
+        left-most (or top-most) one.
+
+        Args:
+            widget: The widget of which to get the neighbour.
+            direction: 'left', 'top', 'right' or 'bottom'.
+            wrap: If True and there is no widget in the requested direction,
+                  the search continues from the opposite side of the layout.
+        """
+        if direction not in self.DIRECTIONS:
+            raise ValueError('"direction" must be one of '
+                             '{}'.format(self.DIRECTIONS))
+        pos = self._positions.get(widget)
+        if pos is None:
+            raise WidgetNotInLayoutException
+        coord, start, end = self._get_edge(pos, self._opposite(direction))
+        coords = self._coords[direction]
+        if direction in ('right', 'bottom'):
+            index = bisect_left(coords, coord)
+            indexes = range(index, len(coords))
+            wrapped = range(0, index)
+        else:
+            index = bisect_right(coords, coord)
+            indexes = range(index - 1, -1, -1)
+            wrapped = range(len(coords) - 1, index - 1, -1)
+        for indexes in (indexes, wrapped) if wrap else (indexes,):
+            for index in indexes:
+                neighbour = self._find_overlap(
+                    self._edges[direction][coords[index]], start, end,
+                    id(widget)
+                )
+                if neighbour is not None:
+                    return neighbour
+        return None
+
+    @staticmethod
+    def _opposite(direction):
+        return {'left': 'right', 'right': 'left',
+                'top': 'bottom', 'bottom': 'top'}[direction]
+
+    @staticmethod
+    def _get_edge(pos, direction):
+        """Returns the edge of a widget that is reached moving in direction.
+
+        Returns:
+            A tuple with the coordinate of the edge and its start and end
+            along the perpendicular axis.
+        """
+        if direction == 'right':
+            return pos[1], pos[0], pos[0] + pos[2]
+        elif direction == 'left':
+            return pos[1] + pos[3], pos[0], pos[0] + pos[2]
+        elif direction == 'bottom':
+            return pos[0], pos[1], pos[1] + pos[3]
+        else:
+            return pos[0] + pos[2], pos[1], pos[1] + pos[3]
+
+    def _find_overlap(self, entries, start, end, exclude):
+        """Finds the entry with the longest overlap with [start, end)."""
+        best = None
+        max_overlap = 0
+        index = max(bisect_left(entries, (start,)) - 1, 0)
+        while index < len(entries) and entries[index][0] < end:
+            tmp_start, tmp_end, key = entries[index]
+            overlap = min(end, tmp_end) - max(start, tmp_start)
+            if overlap > max_overlap and key != exclude:
+                best = key
+                max_overlap = overlap
+            index += 1
+        return self._widgets[best] if best is not None else None
+
+    def _add(self, widget, pos):
+        self._positions[widget] = pos
+        self._widgets[id(widget)] = widget
+        for direction in self.DIRECTIONS:
+            coord, start, end = self._get_edge(pos, direction)
+            entries = self._edges[direction].get(coord)
+            if entries is None:
+                entries = self._edges[direction][coord] = []
+                insort(self._coords[direction], coord)
+            insort(entries, (start, end, id(widget)))
+
+    def _remove(self, widget):
+        pos = self._positions.pop(widget)
+        del self._widgets[id(widget)]
+        for direction in self.DIRECTIONS:
+            coord, start, end = self._get_edge(pos, direction)
+            entries = self._edges[direction][coord]
+            entries.remove((start, end, id(widget)))
+            if not entries:
+                del self._edges[direction][coord]
+                coords = self._coords[direction]
+                del coords[bisect_left(coords, coord)]
+
+    def _update(self, diff):
+        for widget, _ in diff.removed:
+            self._remove(widget)
+        for widget, _, pos in diff.moved:
+            self._remove(widget)
+            self._add(widget, pos)
+        for widget, pos in diff.added:
+            self._add(widget, pos)
+
+
+class TracedOperation(namedtuple('TracedOperation', ['name', 'args',
+                                                     'kwargs', 'result',
+                                                     'elapsed', 'error'])):
+    """A public operation performed on a layout while it was being recorded.
+
+    Attributes:
+        name: The name of the method, or "batch". See TraceRecorder.
+        args: The positional arguments, with every widget replaced by a
+              {"w": id} dict and every collection by a list. A
+              LayoutSnapshot is replaced by a {"snapshot": max_span,
+              "items": [[widget, position], ...]} dict. A callable passed as
+              new widget is replaced by the widget it built.
+        kwargs: The keyword arguments, encoded like args.
+        result: The return value, encoded like args.
+        elapsed: The time the operation took, in seconds.
+        error: The name of the class of the exception raised, or None.
+    """
+
+    __slots__ = ()
+
+
+class TraceRecorder:
+    """Records the public operations performed on a layout.
+
+    Widgets are identified by small integers, so a trace can be saved to a
+    file, replayed with replay_trace and profiled without the application
+    that produced it. Operations called from another recorded operation are
+    not recorded.
+
+    An async operation is recorded as its synchronous counterpart when its
+    result is applied, and its elapsed time only covers applying it. A batch
+    is recorded as a "batch" operation whose result is the number of
+    operations performed in it, which are recorded after it. If the batch
+    is rolled back, its error is recorded and its operations are dropped.
+
+    Attributes:
+        max_span: The max_span of the layout when the recording started.
+        base_span: The max_span the layout was created with.
+        adaptive: The adaptive flag of the layout.
+        undo_limit: The undo_limit of the layout.
+        initial_state: A list of (id, position) tuples with the state of the
+                       layout when the recording started.
+        operations: A list of TracedOperation.
+        replayable: False if the layout changed in a way a replay can't
+                    reproduce: the recording started while the layout was
+                    detached, maximized or in a batch, the layout changed
+                    outside a recorded operation, or undo and redo acted on
+                    a history that the trace doesn't cover.
+    """
+
+    def __init__(self, layout):
+        """Starts recording the operations performed on layout."""
+        self.layout = layout
+        self._ids = {}
+        self._depth = 0
+        self._batch_depth = 0
+        self.max_span = layout.max_span
+        self.base_span = layout._base_span
+        self.adaptive = layout.adaptive
+        self.undo_limit = layout._undo_stack.maxlen
+        self.initial_state = [(self._get_id(widget), pos)
+                              for widget, pos in layout._get_state()]
+        self.operations = []
+        self.replayable = (layout._get_grid() is layout
+                           and not layout.is_maximized())
+        self._inherited_history = bool(layout._undo_stack
+                                       or layout._redo_stack)
+        layout.recorder = self
+        layout.layoutChanged.connect(self._check_recorded)
+
+    def stop(self):
+        """Stops recording."""
+        if self.layout.recorder is self:
+            self.layout.recorder = None
+            self.layout.layoutChanged.disconnect(self._check_recorded)
+
+    def _check_recorded(self, diff):
+        """Marks the trace as not replayable if the layout changed outside
+        a recorded operation."""
+        if not self._depth and not self._batch_depth:
+            self.replayable = False
+
+    def _get_id(self, widget):
+        return self._ids.setdefault(widget, len(self._ids))
+
+    def _encode(self, value):
+        if isinstance(value, (bool, int, float, str, type(None))):
+            return value
+        if isinstance(value, LayoutSnapshot):
+            # Snapshot ids belong to the layout, so they are translated to
+            # the ids of the trace. Unknown ids are kept as None.
+            return {'snapshot': value.max_span,
+                    'items': [[self._encode(
+                                   self.layout._id_widgets.get(widget_id)),
+                               list(pos)]
+                              for widget_id, pos in value.get_state()]}
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return [self._encode(item) for item in value]
+        return {'w': self._get_id(value)}
+
+    def _record(self, name, args, kwargs, run):
+        """Performs an operation and records it if it's not nested.
+
+        Args:
+            name: The name of the public method.
+            args: The positional arguments of the method.
+            kwargs: The keyword arguments of the method.
+            run: A callable without arguments that performs the operation.
+
+        Returns:
+            Whatever run returns.
+        """
+        if self._depth:
+            return run()
+        if name in ('undo', 'redo') and self._inherited_history:
+            self.replayable = False
+        self._depth += 1
+        result = error = None
+        start = perf_counter()
+        try:
+            result = run()
+            return result
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            self._depth -= 1
+            self.operations.append(TracedOperation(
+                name,
+                [self._encode_arg(arg, result) for arg in args],
+                {key: self._encode_arg(value, result)
+                 for key, value in kwargs.items()},
+                self._encode(result), elapsed, error))
+
+    @contextmanager
+    def _record_batch(self):
+        """Records the outermost batch of the layout around its block."""
+        index = len(self.operations)
+        self.operations.append(None)
+        self._batch_depth += 1
+        error = None
+        start = perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            del self.operations[index + 1:]
+            raise
+        finally:
+            self._batch_depth -= 1
+            self.operations[index] = TracedOperation(
+                'batch', [], {}, len(self.operations) - index - 1,
+                perf_counter() - start, error)
+
+    def _encode_arg(self, value, result):
+        """Encodes an argument, replacing a widget factory by its widget.
+
+        If the operation failed, the factory wasn't invoked, so a new id
+        takes the place of the widget it would have built.
+        """
+        if callable(value):
+            value = result if result is not None else object()
+        return self._encode(value)
+
+    def save(self, path):
+        """Writes the trace to a file, one JSON document per line."""
+        with open(path, 'w') as f:
+            json.dump({'max_span': self.max_span,
+                       'base_span': self.base_span,
+                       'adaptive': self.adaptive,
+                       'undo_limit': self.undo_limit,
+                       'replayable': self.replayable,
+                       'state': self.initial_state}, f)
+            f.write('\n')
+            for operation in self.operations:
+                json.dump(list(operation), f, separators=(',', ':'))
+                f.write('\n')
+
+    @classmethod
+    def load(cls, path):
+        """Reads a trace written by save.
+
+        Returns:
+            A TraceRecorder that is not attached to any layout.
+        """
+        trace = cls.__new__(cls)
+        trace.layout = None
+        with open(path) as f:
+            header = json.loads(f.readline())
+            trace.max_span = header['max_span']
+            trace.base_span = header.get('base_span', trace.max_span)
+            trace.adaptive = header.get('adaptive', False)
+            trace.undo_limit = header.get('undo_limit', 0)
+            trace.replayable = header.get('replayable', True)
+            trace.initial_state = [(widget_id, tuple(pos))
+                                   for widget_id, pos in header['state']]
+            trace.operations = [TracedOperation(*json.loads(line))
+                                for line in f if line.strip()]
+        return trace
+
+
+def replay_trace(trace, widget_factory, layout_class=None):
+    """Performs the operations of a trace again on a new layout.
+
+    The layout is created with the max_span, adaptive flag and undo_limit of
+    the recorded one. The operations of a batch are performed inside a
+    batch, and a rolled back batch is skipped.
+
+    Args:
+        trace: A TraceRecorder, possibly loaded from a file.
+        widget_factory: A callable that receives a widget id and returns the
+                        widget that will play its part.
+        layout_class: The class of the layout. Defaults to QTilingLayout.
+
+    Returns:
+        The layout and a list of TracedOperation with the time taken by each
+        operation and the exception it raised in the replay.
+    """
+    layout = (layout_class or QTilingLayout)(
+        max_span=trace.base_span, adaptive=trace.adaptive,
+        undo_limit=trace.undo_limit)
+    if trace.max_span != trace.base_span:
+        layout._rescale(trace.max_span, trace.base_span)
+    widgets = {}
+
+    def decode(value):
+        if isinstance(value, list):
+            return [decode(item) for item in value]
+        if isinstance(value, dict) and 'snapshot' in value:
+            # Id 0 is never given to a widget, so unknown ids stay unknown
+            return LayoutSnapshot.from_state(value['snapshot'], [
+                (layout._get_widget_id(decode(widget)) if widget else 0,
+                 tuple(pos))
+                for widget, pos in value['items']])
+        if isinstance(value, dict):
+            if value['w'] not in widgets:
+                widgets[value['w']] = widget_factory(value['w'])
+            return widgets[value['w']]
+        return value
+
+    for widget_id, pos in trace.initial_state:
+        layout.addWidget(decode({'w': widget_id}), *pos)
+    replayed = []
+    batch = None
+    for operation in trace.operations:
+        if operation.name == 'batch':
+            replayed.append(operation._replace(elapsed=0))
+            if operation.result:
+                batch_index, remaining = len(replayed) - 1, operation.result
+                batch_start = perf_counter()
+                batch = layout.batch()
+                batch.__enter__()
+            continue
+        args = [decode(arg) for arg in operation.args]
+        kwargs = {key: decode(value)
+                  for key, value in operation.kwargs.items()}
+        result = error = None
+        start = perf_counter()
+        try:
+            result = getattr(layout, operation.name)(*args, **kwargs)
+        except Exception as e:
+            error = type(e).__name__
+        elapsed = perf_counter() - start
+        replayed.append(operation._replace(
+            args=args, kwargs=kwargs, result=result, elapsed=elapsed,
+            error=error))
+        if batch is not None:
+            remaining -= 1
+            if not remaining:
+                error = None
+                try:
+                    batch.__exit__(None, None, None)
+                except Exception as e:
+                    error = type(e).__name__
+                batch = None
+                replayed[batch_index] = replayed[batch_index]._replace(
+                    elapsed=perf_counter() - batch_start, error=error)
+    return layout, replayed
+
+
+class InvalidBlockException(Exception):
+    """Raised if a Block has no area or doesn't fit in the layout."""
+    pass
+
+
+class Block:
+    """A rectangular area inside a layout"""
+
+    __slots__ = ('layout', 'transpose', 'i', 'j', 'rowspan', 'colspan')
+
+    def __init__(self, layout, transpose, i, j, rowspan, colspan):
+        if not (
+                i >= 0 and j >= 0 and rowspan > 0 and colspan > 0
+                and 0 <= i < layout.max_span
+                and 0 <= j < layout.max_span
+                and 0 < i + rowspan <= layout.max_span
+                and 0 < j + colspan <= layout.max_span
+        ):
+            raise InvalidBlockException
+        self.layout = layout
+        self.transpose = transpose
+        self.i = i
+        self.j = j
+        self.rowspan = rowspan
+        self.colspan = colspan
+
+    def __repr__(self):
+        return '{}: {}, {}, {}, {}'.format(type(self).__name__, self.i,
+                                           self.j, self.rowspan, self.colspan)
+
+    def __eq__(self, other):
+        return (self.layout is other.layout
+                and self.transpose == other.transpose
+                and self.i == other.i
+                and self.j == other.j
+                and self.rowspan == other.rowspan
+                and self.colspan == other.colspan)
+
+
+class NonRectangularRecBlockException(Exception):
+    pass
+
+
+class RecBlock(Block):
+    """A Block whose widgets are entirely contained in it."""
+
+    __slots__ = ()
+
+    def __init__(self, layout, transpose, i, j, rowspan, colspan):
+        """Builds a Block that no widget exceeds its limits."""
+        super().__init__(layout, transpose, i, j, rowspan, colspan)
+        index = self.i
+        while index < self.i + self.rowspan:
+            item = self.layout._item_at_position(index, self.j, self.transpose)
+            if item:
+                item_pos = self.layout._get_item_position(item.widget(),
+                                                          self.transpose)
+                if item_pos[1] != self.j:
+                    raise NonRectangularRecBlockException
+                index += item_pos[2]
+            else:
+                index += 1
+
+        index = self.i
+        while index < self.i + self.rowspan:
+            item = self.layout._item_at_position(index,
+                                                 self.j + self.colspan - 1,
+                                                 self.transpose)
+            if item:
+                item_pos = self.layout._get_item_position(item.widget(),
+                                                          self.transpose)
                 if item_pos[1] + item_pos[3] != self.j + self.colspan:
                     raise NonRectangularRecBlockException
                 index += item_pos[2]
@@ -623,18 +3052,51 @@ class RecBlock(Block):
         the represented block. Each cell contains either the instance of the
         widget that occupies that position or None if it's empty.
         """
-        return [
-            tuple(self.layout._item_at_position(row, col,
-                                                self.transpose).widget()
-                  if self.layout._item_at_position(row, col, self.transpose)
-                  else None
-                  for col in range(self.j, self.j + self.colspan))
-            for row in range(self.i, self.i + self.rowspan)
-        ]
+        virtual_block, widgets = self._virtualize_ids()
+        return [tuple(widgets[widget_id] for widget_id in row)
+                for row in virtual_block]
+
+    def _virtualize_ids(self):
+        """Same as _virtualize, but with small integers instead of widgets.
+
+        Rows made of integers are cheaper to hash and compare than rows made
+        of widgets, which displace_and_resize does for every row.
+
+        Returns:
+            The virtual block, in which 0 means empty, and a list to map the
+            integers back to widgets.
+        """
+        widgets = [None]
+        ids = {}
+        virtual_block = []
+        for row in range(self.i, self.i + self.rowspan):
+            virtual_row = []
+            for col in range(self.j, self.j + self.colspan):
+                item = self.layout._item_at_position(row, col, self.transpose)
+                if item is None:
+                    virtual_row.append(0)
+                    continue
+                widget = item.widget()
+                widget_id = ids.get(widget)
+                if widget_id is None:
+                    widget_id = ids[widget] = len(widgets)
+                    widgets.append(widget)
+                virtual_row.append(widget_id)
+            virtual_block.append(tuple(virtual_row))
+        return virtual_block, widgets
 
     @staticmethod
-    def _materialize_virtual_block(i, j, virtual_block):
-        """Maps a virtual block to a list of tuples (widget, position)."""
+    def _materialize_virtual_block(i, j, virtual_block, widgets=None):
+        """Maps a virtual block to a list of tuples (widget, position).
+
+        Args:
+            i: The row of the top-left corner of the block.
+            j: The column of the top-left corner of the block.
+            virtual_block: A virtual block as returned by _virtualize, or by
+                           _virtualize_ids if widgets is given.
+            widgets: The list returned along with the virtual block by
+                     _virtualize_ids.
+        """
         block = {}
         for row in range(len(virtual_block)):
             for col in range(len(virtual_block[0])):
@@ -651,12 +3113,14 @@ class RecBlock(Block):
                 else:
                     block[widget] = (i + row, j + col, 1, 1)
 
-        return block.items()
+        if widgets is None:
+            return block.items()
+        return [(widgets[widget_id], pos) for widget_id, pos in block.items()]
 
     def displace_and_resize(self, displacement, growth):
         """Vertically displaces and/or resizes the RecBlock."""
         heights = []
-        virtual_block = self._virtualize()
+        virtual_block, widgets = self._virtualize_ids()
         if growth:
             prev_row = None
             common_height = 0
@@ -708,7 +3172,8 @@ class RecBlock(Block):
             virtual_block = new_virtual_block
 
         materialized = self._materialize_virtual_block(self.i + displacement,
-                                                       self.j, virtual_block)
+                                                       self.j, virtual_block,
+                                                       widgets)
         for widget, _ in materialized:
             self.layout.removeWidget(widget)
         for widget, pos in materialized:
@@ -727,6 +3192,8 @@ class ImpossibleToBuildBlockException(Exception):
 
 class CriticalBlock(RecBlock):
 
+    __slots__ = ()
+
     def __init__(self, layout, transpose, i, j, rowspan, colspan):
         super().__init__(layout, transpose, i, j, rowspan, colspan)
         # TODO: find a way to avoid looping over every row
@@ -803,6 +3270,8 @@ class WidgetInEmptyBlockException(Exception):
 class EmptyBlock(Block):
     """A Block made entirely of empty space"""
 
+    __slots__ = ()
+
     def __init__(self, layout, transpose, i, j, rowspan, colspan):
         """Creates an Emptyblock.
 